@@ -9,7 +9,8 @@ from numpy import array
 from scipy.stats.mstats import mquantiles as mq
 from lmfit import fit_report
 from radd.tools import messages
-from radd import theta, vis
+from radd import theta, vis, parallel
+from radd.checkpoint import Checkpoint
 
 class RADDCore(object):
     """ Parent class for constructing attributes and methods used by
@@ -37,6 +38,7 @@ class RADDCore(object):
         self.track_basins = False
         self.pbars = None
         self.is_nested = False
+        self.checkpoint = None
 
     def __prepare_fit__(self):
         """ model setup and initiates dataframes. Automatically run when Model object is initialized
@@ -104,7 +106,10 @@ class RADDCore(object):
             self.fitparams = {'ix':0, 'ntrials': 20000, 'tol': 1.e-30, 'method': 'nelder',
                 'maxfev': 3000, 'tb': self.tb, 'nlevels': 1, 'fit_on': self.fit_on,
                 'kind': self.kind, 'clmap': self.clmap, 'quantiles': self.quantiles,
-                'model_id': self.model_id,  'depends_on': self.depends_on}
+                'model_id': self.model_id,  'depends_on': self.depends_on, 'engine': 'mc',
+                'max_bytes': None, 'compact': False, 'cache_size': None, 'cache_bytes': None, 'emulator': None,
+                'antithetic': False, 'stratified': False, 'control_variate': False,
+                'seed': None, 'smooth_h': .02}
             self.fitparams = pd.Series(self.fitparams)
         else:
             # fill with kwargs (i.e. y, wts, ix, etc) for the upcoming fit
@@ -131,7 +136,10 @@ class RADDCore(object):
         if not hasattr(self, 'basinparams'):
             self.basinparams =  {'ninits': 3, 'nsamples': 3000, 'interval': 10, 'T': 1.,
             'stepsize': .05,  'niter': 100, 'nsuccess': 60, 'tol': 1.e-20, 'method': 'TNC',
-            'init_sample_method': 'best', 'progress': False, 'disp': False}
+            'init_sample_method': 'best', 'progress': False, 'disp': False, 'nworkers': 1,
+            'seed': None, 'ntrials_schedule': None, 'race_niter': None, 'race_eta': 2,
+            'popsize': 15, 'sim_bank': False, 'transform': False,
+            'split_levels': False, 'surrogate_evals': 150}
         else:
             # fill with kwargs for the upcoming fit
             for kw_arg, kw_val in kwargs.items():
@@ -196,20 +204,40 @@ class RADDCore(object):
     def __set_ssd_info__(self):
         """ set ssd_info for upcoming fit and store in fitparams dict
         """
+        # store all ssd_info in fitparams, accessed by Simulator
+        self.fitparams['ssd_info'] = self.__get_ssd_info__(self.fitparams['ix'], self.fitparams.nlevels)
+
+    def __get_ssd_info__(self, ix=0, nlevels=1):
+        """ ssd_info [ssd, nssd, nss, nss_per_ssd, ssd_ix] for fit index ix
+        """
         if self.fit_on=='average':
             ssd = np.array(self.ssd).mean(axis=0)
         else:
             # get ssd vector for fit index == ix
-            ssd = self.ssd[self.fitparams['ix']]
-        if self.fitparams.nlevels==1:
+            ssd = self.ssd[ix]
+        if nlevels==1:
             # single vector (nlevels=1), don't squeeze
             ssd = np.mean(ssd, axis=0, keepdims=True)
         nssd = ssd.shape[-1]
         nss = int((.5 * self.fitparams.ntrials))
         nss_per_ssd = int(nss/nssd)
         ssd_ix = np.arange(nssd) * np.ones((ssd.shape[0], ssd.shape[-1])).astype(np.int)
-        # store all ssd_info in fitparams, accessed by Simulator
-        self.fitparams['ssd_info'] = [ssd, nssd, nss, nss_per_ssd, ssd_ix]
+        return [ssd, nssd, nss, nss_per_ssd, ssd_ix]
+
+    def get_subject_fitparams(self, ix=0, nlevels=1):
+        """ copy of fitparams for fitting the ix'th subject with nlevels
+        (y, wts & ssd_info as set by update_data() and __set_ssd_info__),
+        without updating the model's optimizer/simulator
+        """
+        fp = self.fitparams.copy()
+        fp['ix'], fp['nlevels'] = ix, nlevels
+        if nlevels>1:
+            fp['y'], fp['wts'] = self.observed[ix], self.cond_wts[ix]
+        else:
+            fp['y'], fp['wts'] = self.observed_flat[ix], self.flat_wts[ix]
+        if hasattr(self, 'ssd'):
+            fp['ssd_info'] = self.__get_ssd_info__(ix, nlevels)
+        return fp
 
     def update_quantiles(self):
         """ recalculate observed dataframes w/ passed quantiles array
@@ -229,13 +257,30 @@ class RADDCore(object):
             nsamples = self.basinparams['nsamples']
         if nkeep is None:
             nkeep = self.basinparams['ninits']
-        unfiltered = theta.random_inits(pkeys, ninits=nsamples, kind=self.kind, as_list=True)
-        self.filter_params(unfiltered, nsamples=nsamples, nkeep=nkeep)
+        ix = self.fitparams['ix']
+        if self.checkpoint is not None and self.checkpoint.get(('param_sets', ix)) is not None:
+            # inits already sampled for this subject (resumed fit)
+            self.param_sets = self.checkpoint.get(('param_sets', ix))
+            self.finished_sampling = True
+            return
+        if self.basinparams['sim_bank']:
+            # screen samples simulated once for all subjects
+            unfiltered, yhats = self.get_sim_bank(pkeys=pkeys, nsamples=nsamples)
+            self.filter_params(unfiltered, nsamples=nsamples, nkeep=nkeep, yhats=yhats)
+        else:
+            if self.basinparams['seed'] is not None:
+                # same samples for a given seed & subject
+                np.random.seed(self.basinparams['seed'] + self.fitparams['ix'])
+            unfiltered = theta.random_inits(pkeys, ninits=nsamples, kind=self.kind, as_list=True)
+            self.filter_params(unfiltered, nsamples=nsamples, nkeep=nkeep)
         self.finished_sampling = True
+        if self.checkpoint is not None:
+            self.checkpoint.put(('param_sets', ix), self.param_sets, force=True)
 
-    def filter_params(self, p_sets=None, nsamples=None, nkeep=None):
+    def filter_params(self, p_sets=None, nsamples=None, nkeep=None, yhats=None):
         """ sample *nsamples* (default=5000, see set_fitparams) different
-        parameter sets (param_sets) and get model yhat for each set (param_yhats)
+        parameter sets (param_sets) and get model yhat for each set (param_yhats).
+        If yhats (len(p_sets), len(y)) are given, p_sets are not simulated
         """
         if nsamples is None:
             nsamples = self.basinparams['nsamples']
@@ -243,9 +288,142 @@ class RADDCore(object):
             nkeep = self.basinparams['ninits']
         if p_sets is None:
             p_sets = self.param_sets
-        p_fmins = [self.optimizer.simulator.cost_fx(p, sse=1) for p in p_sets]
+        if yhats is not None:
+            p_fmins = np.sum(self.optimizer.simulator.residuals(yhats)**2, axis=1)
+        elif self.basinparams['nworkers'] > 1:
+            p_fmins = self.get_pool().cost(p_sets, self.fitparams['y'], self.fitparams['wts'])
+        elif self.optimizer.simulator.emulates(p_sets[0]):
+            p_fmins = self.optimizer.simulator.batch_cost_fx(p_sets)
+        else:
+            p_fmins = [self.optimizer.simulator.cost_fx(p, sse=1) for p in p_sets]
         method = self.basinparams['init_sample_method']
         self.param_sets, self.gmin = theta.filter_params(p_sets, p_fmins, nkeep=nkeep, method=method)
+        if yhats is not None:
+            # bank p_sets are shared by all subjects
+            self.param_sets = deepcopy(self.param_sets)
+
+    def get_sim_bank(self, pkeys=None, nsamples=None, fitparams=None):
+        """ nsamples random parameter sets and their simulated yhats (nsamples, len(y)).
+        yhat does not depend on a subject's data, only on the simulated ssd/tb/nlevels
+        configuration (& engine, compact, dt, si), so each bank is simulated once per
+        configuration and reused to screen inits for every subject (see filter_params)
+        ::Arguments::
+            fitparams (dict):
+                fitparams of the subject (default: model fitparams, simulated
+                by the model's simulator/worker pool)
+        ::Returns::
+            p_sets (list), yhats (ndarray)
+        """
+        from radd.models import Simulator
+        if pkeys is None:
+            pkeys = np.sort(list(self.inits))
+        if nsamples is None:
+            nsamples = self.basinparams['nsamples']
+        fp = self.fitparams if fitparams is None else fitparams
+        ssd = b''
+        if 'ssd_info' in fp.keys():
+            ssd = np.asarray(fp['ssd_info'][0], dtype=np.float64).tobytes()
+        # banks are only shared by simulators that give the same yhats
+        sim = self.optimizer.simulator
+        engine, compact = fp.get('engine', 'mc'), fp.get('compact', False)
+        key = (self.kind, tuple(pkeys), nsamples, fp['nlevels'], fp['ntrials'], fp['tb'], ssd, engine, compact, sim.dt, sim.si)
+        if not hasattr(self, 'sim_banks'):
+            self.sim_banks = {}
+        if key not in self.sim_banks:
+            if self.basinparams['seed'] is not None:
+                np.random.seed(self.basinparams['seed'])
+            p_sets = theta.random_inits(pkeys, ninits=nsamples, kind=self.kind, as_list=True)
+            if fitparams is None and self.basinparams['nworkers'] > 1:
+                yhats = self.get_pool().sim(p_sets)
+            elif fitparams is None:
+                yhats = self.optimizer.simulator.batch_sim_fx(p_sets)
+            else:
+                yhats = Simulator(fitparams=fp, kind=self.kind, pc_map=self.pc_map, dt=sim.dt, si=sim.si).batch_sim_fx(p_sets)
+            self.sim_banks[key] = (p_sets, yhats)
+        return self.sim_banks[key]
+
+    def tune_ntrials(self, p=None, target=.05, nreps=20, apply=False):
+        """ estimate the monte carlo noise of the cost at p (default: popt of the last
+        fit, else inits) and the smallest ntrials keeping its sd below target * chi
+        (see Simulator.noise_floor). If apply, fitparams['ntrials'] is set to it.
+        Also reports the coarsest dt whose discretization shifts the cost by less
+        than target * chi (see Simulator.coarsest_dt). dt is a Simulator argument,
+        so it is never applied. Use set_fitparams(tol='noise') to stop local
+        optimization at the noise floor
+        ::Returns::
+            noise (dict): see Simulator.noise_floor, plus dt & dt_max (recommended dt)
+        """
+        if p is None:
+            p = getattr(self, 'popt', self.inits)
+        simulator = self.optimizer.simulator
+        noise = simulator.noise_floor(dict(deepcopy(p)), nreps=nreps, target=target)
+        noise['dt'] = simulator.dt
+        noise['dt_max'] = simulator.coarsest_dt(dict(deepcopy(p)), noise, target=target, nreps=nreps)
+        if apply and noise['ntrials_min'] is not None:
+            self.set_fitparams(ntrials=noise['ntrials_min'])
+        return noise
+
+    def build_emulator(self, path, nsamples=20000, seed=None, ix=None):
+        """ pre-simulate the flat model of subject ix (default: current fit index)
+        on nsamples parameter sets and save the table to path (see radd.emulator).
+        Use it for the global stage of this (and any other) job w/ the same
+        kind, tb, quantiles & ssds by setting fitparams['emulator'] = path
+        """
+        from radd import emulator
+        if ix is None:
+            ix = self.fitparams['ix']
+        fp = self.get_subject_fitparams(ix, nlevels=1)
+        pkeys = np.sort(list(self.inits))
+        return emulator.build_table(path, fp, kind=self.kind, pkeys=pkeys, nsamples=nsamples, seed=seed)
+
+    def get_pool(self):
+        """ get (or start) the SimulatorPool used to score parameter sets in
+        parallel (see radd.parallel), reusing its workers whenever possible
+        """
+        bp = self.basinparams
+        args = (self.fitparams, self.kind, self.pc_map, bp['nworkers'], bp['seed'])
+        if hasattr(self, 'pool'):
+            if self.pool.matches(*args):
+                return self.pool
+            self.pool.close()
+        self.pool = parallel.SimulatorPool(*args)
+        return self.pool
+
+    def set_checkpoint(self, path=None, resume=False, interval=300.):
+        """ checkpoint finished work (sampled inits, basinhopping runs and
+        flat/conditional fits) to path every <interval> seconds, and after each
+        finished fit. If resume, work found in an existing checkpoint at path
+        is skipped (see radd.checkpoint). path=None turns checkpointing off
+        """
+        if path is None:
+            self.checkpoint = None
+        else:
+            self.checkpoint = Checkpoint(path, interval=interval, resume=resume)
+        self.optimizer.checkpoint = self.checkpoint
+
+    def save_fit(self, fit_id='flat'):
+        """ store results of the finished fit (fit_id='flat' or model_id)
+        of subject ix in the checkpoint, dropping its partial results
+        """
+        if self.checkpoint is None:
+            return
+        ix = self.fitparams['ix']
+        if fit_id=='flat':
+            self.checkpoint.drop(('param_sets', ix), ('hops', ix), ('race', ix), ('evolution', ix))
+        fit = (self.finfo, self.popt, self.yhat, self.optimizer.param_report)
+        self.checkpoint.put(('fit', fit_id, ix), fit, force=True)
+
+    def load_fit(self, fit_id='flat'):
+        """ restore finfo, popt, yhat (and param_report) of subject ix
+        from the checkpoint, returns False if that fit is not finished
+        """
+        if self.checkpoint is None:
+            return False
+        fit = self.checkpoint.get(('fit', fit_id, self.fitparams['ix']))
+        if fit is None:
+            return False
+        self.finfo, self.popt, self.yhat, self.optimizer.param_report = fit
+        return True
 
     def log_fit_info(self, finfo=None, popt=None, yhat=None):
         """ write meta-information about latest fit
@@ -7,7 +7,7 @@ from numpy import array
 from radd.models import Simulator
 from radd.CORE import RADDCore
 from radd.theta import Parameters
-from radd import vis
+from radd import vis, parallel
 from radd.tools import utils
 
 class Model(RADDCore, Parameters):
@@ -38,7 +38,7 @@ class Model(RADDCore, Parameters):
 
         super(Model, self).__init__(data=data, inits=inits, fit_on=fit_on, depends_on=depends_on, kind=kind, quantiles=quantiles, weighted=weighted, ssd_method=ssd_method)
 
-    def optimize(self, plotfits=True, saveplot=False, saveresults=True, saveobserved=False, custompath=None, progress=False):
+    def optimize(self, plotfits=True, saveplot=False, saveresults=True, saveobserved=False, custompath=None, progress=False, checkpoint=None, resume=False):
         """ Method to be used for accessing fitting methods in Optimizer class
         see Optimizer method optimize()
         plotfits (bool):
@@ -54,22 +54,113 @@ class Model(RADDCore, Parameters):
             all saved output will write to "~/<custompath>/<self.model_id>/"
         progress (bool):
             track progress across ninits and basinhopping
+        checkpoint (str):
+            path of checkpoint file to save finished work to (see set_checkpoint())
+        resume (bool):
+            if True, skip work already saved in checkpoint file
         """
         self.set_basinparams(progress=progress)
+        if checkpoint is not None:
+            self.set_checkpoint(checkpoint, resume=resume)
+        self.optimizer.checkpoint = self.checkpoint
         if np.any([saveplot, saveresults]):
             self.handler.make_results_dir(custompath=custompath)
-        for ix in range(len(self.observed)):
-            if not hasattr(self, 'flat_popt'):
-                self.set_fitparams(ix=ix, nlevels=1)
-                self.optimize_flat()
-            if not self.is_flat:
-                self.set_fitparams(ix=ix, nlevels=self.nlevels)
-                self.optimize_conditional()
-            if plotfits:
-                self.plot_model_fits(save=saveplot)
+        if self.fit_on=='subjects' and self.basinparams['nworkers'] > 1:
+            self.optimize_subjects(plotfits=plotfits, saveplot=saveplot)
+        else:
+            fit_flat = not hasattr(self, 'flat_popt')
+            for ix in range(len(self.observed)):
+                if fit_flat:
+                    self.set_fitparams(ix=ix, nlevels=1)
+                    if ix > 0:
+                        # sample new inits for each subject
+                        self.finished_sampling = False
+                    self.optimize_flat()
+                if not self.is_flat:
+                    self.set_fitparams(ix=ix, nlevels=self.nlevels)
+                    self.optimize_conditional()
+                if plotfits:
+                    self.plot_model_fits(save=saveplot)
+        if self.checkpoint is not None:
+            self.checkpoint.flush()
         if saveresults:
             self.handler.save_results(saveobserved)
 
+    def optimize_subjects(self, plotfits=True, saveplot=False):
+        """ fit all subjects in parallel on basinparams['nworkers'] processes,
+        each subject with its own Simulator & Optimizer (see parallel.fit_subject).
+        Fits are written to fitDF/yhatDF (and logged/plotted) in subject order,
+        same as the serial loop in optimize()
+        ::Arguments::
+            plotfits (bool):
+                if True (default), plot model predictions over observed data
+            saveplot (bool):
+                if True (default is False), save plots to model.handler.results_dir
+        """
+        nsubjects = len(self.observed)
+        bp = dict(self.basinparams)
+        # subjects are the unit of parallelism, each worker fits serially
+        bp['nworkers'], bp['progress'] = 1, False
+        flat_popt = getattr(self, 'flat_popt', None)
+        fit_ids = {'flat': 'flat', 'cond': self.model_id}
+        subject_fits, tasks = [], []
+        for ix in range(nsubjects):
+            fits = {'ix': ix}
+            if self.checkpoint is not None:
+                # fits finished before a resumed job was interrupted
+                for fit, fit_id in fit_ids.items():
+                    saved = self.checkpoint.get(('fit', fit_id, ix))
+                    if saved is not None and (fit=='cond' or flat_popt is None):
+                        fits[fit] = saved
+            fit_flat = flat_popt is None and 'flat' not in fits
+            fit_cond = not self.is_flat and 'cond' not in fits
+            subject_fits.append(fits)
+            if not (fit_flat or fit_cond):
+                continue
+            subject_popt = flat_popt
+            if 'flat' in fits:
+                subject_popt = fits['flat'][1]
+            flat_fp = dict(self.get_subject_fitparams(ix, nlevels=1))
+            cond_fp = None
+            if fit_cond:
+                cond_fp = dict(self.get_subject_fitparams(ix, nlevels=self.nlevels))
+            bank = None
+            if fit_flat and self.basinparams['sim_bank']:
+                bank = self.get_sim_bank(fitparams=flat_fp)
+            tasks.append((ix, flat_fp, cond_fp, bp, self.kind, self.pc_map, self.depends_on, self.inits, subject_popt, bank, None))
+        fitted_ix = [task[0] for task in tasks]
+        new_fits = parallel.fit_subjects(tasks, nworkers=self.basinparams['nworkers'])
+        if self.basinparams['progress']:
+            self.sbar = utils.PBinJ(n=nsubjects, color='b', status='Subjects {}/{}'.format('{}', nsubjects))
+        for fits in subject_fits:
+            ix = fits['ix']
+            if ix in fitted_ix:
+                fitted = next(new_fits)
+                for fit in ['flat', 'cond']:
+                    if fit in list(fitted):
+                        fits[fit] = fitted[fit]
+                        if self.checkpoint is not None:
+                            self.checkpoint.put(('fit', fit_ids[fit], ix), fitted[fit], force=True)
+            for fit, nlevels in [('flat', 1), ('cond', self.nlevels)]:
+                if fit not in list(fits):
+                    continue
+                self.fitparams = self.get_subject_fitparams(ix, nlevels=nlevels)
+                self.finfo, self.popt, self.yhat, self.optimizer.param_report = fits[fit]
+                if fit=='flat':
+                    self.flat_popt = deepcopy(self.popt)
+                if fit=='cond' or self.is_flat:
+                    self.write_results()
+            if plotfits:
+                self.plot_model_fits(save=saveplot)
+            if self.basinparams['progress']:
+                self.sbar.update(value=ix, status=ix+1)
+        # shut down worker pool
+        new_fits.close()
+        if self.basinparams['progress']:
+            self.sbar.clear()
+        # point optimizer & simulator at the last subject, as after the serial loop
+        self.set_fitparams(ix=ix, nlevels=nlevels)
+
     def optimize_flat(self):
         """ optimizes flat model to data collapsing across all conditions
         ::Arguments::
@@ -81,12 +172,17 @@ class Model(RADDCore, Parameters):
             finfo_flat (pd.Series): fit info (AIC, BIC, chi2, redchi, etc)
             popt_flat (dict): optimized parameters dictionary
         """
-        if not self.finished_sampling:
-            self.sample_param_sets()
-        # Global Optimization w/ Basinhopping (+TNC)
-        p = self.optimizer.hop_around(inits=self.param_sets)
-        # Flat Simplex Optimization of Parameters at Global Minimum
-        self.finfo, self.popt, self.yhat = self.optimizer.gradient_descent(p=p)
+        if not self.load_fit('flat'):
+            if not self.finished_sampling:
+                self.sample_param_sets()
+            # Global Optimization w/ Basinhopping (+TNC)
+            pool = None
+            if self.basinparams['nworkers'] > 1:
+                pool = self.get_pool()
+            p = self.optimizer.hop_around(inits=self.param_sets, pool=pool)
+            # Flat Simplex Optimization of Parameters at Global Minimum
+            self.finfo, self.popt, self.yhat = self.optimizer.gradient_descent(p=p)
+            self.save_fit('flat')
         self.flat_popt = deepcopy(self.popt)
         if self.is_flat:
             self.write_results()
@@ -103,14 +199,20 @@ class Model(RADDCore, Parameters):
             popt (dict): optimized parameters dictionary
             flat_popt (dict): deepcopy of popt
         """
-        p = self.__check_inits__(deepcopy(self.flat_popt))
-        # Pretune Conditional Parameters
-        p, fmin = self.optimizer.run_basinhopping(p)
-        # Final Simplex Optimization
-        self.finfo, self.popt, self.yhat = self.optimizer.gradient_descent(p=p, flat=False)
+        if not self.load_fit(self.model_id):
+            p = self.__check_inits__(deepcopy(self.flat_popt))
+            if self.basinparams['split_levels'] and self.optimizer.levels_separable():
+                # one small flat fit per level, run on nworkers processes
+                self.finfo, self.popt, self.yhat = self.optimizer.fit_levels(p, nworkers=self.basinparams['nworkers'])
+            else:
+                # Pretune Conditional Parameters
+                p, fmin = self.optimizer.run_basinhopping(p)
+                # Final Simplex Optimization
+                self.finfo, self.popt, self.yhat = self.optimizer.gradient_descent(p=p, flat=False)
+            self.save_fit(self.model_id)
         self.write_results()
 
-    def nested_optimize(self, free=[], cond=None, saveplot=True, plotfits=True, custompath=None, progress=False):
+    def nested_optimize(self, free=[], cond=None, saveplot=True, plotfits=True, custompath=None, progress=False, checkpoint=None, resume=False):
         """ optimize a series of models using same init parameters where the i'th model
             has depends_on = {<models[i]> : <cond>}. (NOTE: only for models with fit_on='average')
         ::Arguments::
@@ -127,8 +229,14 @@ class Model(RADDCore, Parameters):
                 all saved output will write to "~/<custompath>/<self.model_id>/"
             progress (bool):
                 track progress across model fits, ninits, and basinhopping
+            checkpoint (str):
+                path of checkpoint file to save finished work to (see set_checkpoint())
+            resume (bool):
+                if True, skip models/fits already saved in checkpoint file
         """
         self.is_nested = True
+        if checkpoint is not None:
+            self.set_checkpoint(checkpoint, resume=resume)
         if progress:
             self.set_basinparams(progress=progress)
             pnames = [vis.parameter_name(param, True) for param in free]
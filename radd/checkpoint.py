@@ -0,0 +1,73 @@
+#!/usr/local/bin/env python
+from __future__ import division
+import os
+import time
+import pickle
+
+
+class Checkpoint(object):
+    """ on-disk record of the work finished during Model.optimize(), used
+    to resume a fit that was interrupted. Only small pieces of fit state are
+    stored (never the Model, its dataframes or the Simulator's random buffers):
+
+        ('param_sets', ix): filtered inits sampled for subject ix
+        ('hops', ix): {i: (popt, fmin)} of each finished basinhopping run (hop_around)
+        ('race', ix): (niter, popts, fmins) of the last finished round of race_inits
+        ('evolution', ix): population & RNG state after the last finished
+                generation of run_evolution (basinparams['method']='DE')
+        ('fit', fit_id, ix): (finfo, popt, yhat, param_report) of a finished
+                flat (fit_id='flat') or conditional (fit_id=model_id) fit
+
+    Arguments:
+        path (str): checkpoint file, loaded if it exists and resume is True
+        interval (float): min. seconds between saves when put() is not forced
+        resume (bool): if False, any existing checkpoint at path is ignored
+    """
+    def __init__(self, path, interval=300., resume=True):
+        self.path = os.path.expanduser(path)
+        self.interval = interval
+        self.state = {}
+        self.dirty = False
+        if resume and os.path.isfile(self.path):
+            self.load()
+        self.last_save = time.time()
+
+    def load(self):
+        """ read state from path """
+        with open(self.path, 'rb') as f:
+            self.state = pickle.load(f)
+
+    def save(self):
+        """ write state to path (via a temp file, so an interrupted save
+        never leaves a corrupt checkpoint)
+        """
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self.state, f, protocol=2)
+        getattr(os, 'replace', os.rename)(tmp, self.path)
+        self.last_save = time.time()
+        self.dirty = False
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+
+    def put(self, key, value, force=False):
+        """ store value under key, saving to disk if force
+        or if interval seconds have passed since the last save
+        """
+        self.state[key] = value
+        self.dirty = True
+        if force or (time.time() - self.last_save) > self.interval:
+            self.save()
+
+    def drop(self, *keys):
+        """ remove keys (e.g., partial results of a finished fit) """
+        for key in keys:
+            if key in self.state:
+                del self.state[key]
+                self.dirty = True
+
+    def flush(self):
+        """ save if anything changed since the last save """
+        if self.dirty:
+            self.save()
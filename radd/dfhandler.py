@@ -145,7 +145,7 @@ class DataHandler(object):
             if self.model.is_nested:
                 idxname = self.model.model_id.split('_')[1]
         else:
-            idxname = self.idx[fitparams['idx']]
+            idxname = self.idx[fitparams['ix']]
         data_widx = data.copy()
         data_widx['idx'] = idxname
         fitDF.loc[row, self.f_cols] = data_widx
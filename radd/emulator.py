@@ -0,0 +1,194 @@
+#!/usr/local/bin/env python
+from __future__ import division
+from copy import deepcopy
+import os
+import json
+import shutil
+import numpy as np
+from numpy import newaxis as na
+from scipy.spatial import cKDTree
+from radd import theta
+
+# Emulators loaded by this process, keyed on table path (see load_emulator())
+emulators = {}
+
+def latin_hypercube(nsamples, ndim):
+    """ nsamples points of a latin hypercube design in the unit cube
+    (each dimension split into nsamples strata, one point per stratum)
+    """
+    strata = np.argsort(np.random.sample((ndim, nsamples)), axis=1).T
+    return (strata + np.random.sample((nsamples, ndim))) / nsamples
+
+def build_table(path, fitparams, kind='xdpm', pkeys=None, nsamples=20000, seed=None, nbatch=1000):
+    """ pre-simulate yhat on a latin hypercube design over theta.get_bounds() for
+    the kind, tb, quantiles & ssd_info of a flat fit (nlevels=1) and save it as
+    an emulator table, i.e. a directory holding:
+
+        X.npy: design points (nsamples, len(pkeys))
+        Y.npy: simulated yhat at each point (nsamples, len(yhat))
+        meta.json: pkeys, bounds & the simulated configuration
+
+    X/Y are written (and later read) as memory-mapped arrays, so a table is
+    built once, offline, and shared by all jobs fitting the same configuration
+    ::Arguments::
+        path (str):
+            directory of the table (overwritten if it exists)
+        fitparams (dict):
+            fitparams of a flat fit (see RADDCore.get_subject_fitparams),
+            ntrials sets the number of trials simulated at each point
+        pkeys (list):
+            parameters spanned by the design (default: theta.get_default_inits)
+    ::Returns::
+        emulator (Emulator)
+    """
+    from radd.models import Simulator
+    path = os.path.expanduser(path)
+    if pkeys is None:
+        pkeys = list(theta.get_default_inits(kind=kind))
+    pkeys = [str(pk) for pk in np.sort(pkeys)]
+    fp = deepcopy(fitparams)
+    fp['nlevels'] = 1
+    for key in ['emulator', 'cache_size', 'cache_bytes']:
+        fp[key] = None
+    if seed is not None:
+        np.random.seed(seed)
+    bounds = theta.get_bounds(kind=kind)
+    xmin = np.array([bounds[pk][0] for pk in pkeys])
+    xmax = np.array([bounds[pk][1] for pk in pkeys])
+    X = xmin + latin_hypercube(nsamples, len(pkeys)) * (xmax - xmin)
+    simulator = Simulator(fitparams=fp, kind=kind, pc_map={})
+    # build in a temp dir, so jobs never load a partially written table
+    tmp = path + '.tmp'
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'X.npy'), X)
+    Y = None
+    for i in range(0, nsamples, nbatch):
+        p_sets = [dict(zip(pkeys, x)) for x in X[i:i+nbatch]]
+        yhats = simulator.batch_sim_fx(p_sets)
+        if Y is None:
+            Y = np.lib.format.open_memmap(os.path.join(tmp, 'Y.npy'), mode='w+', dtype=np.float64, shape=(nsamples, yhats.shape[1]))
+        Y[i:i+nbatch] = yhats
+    Y.flush()
+    del Y
+    ssd = None
+    if simulator.include_ss:
+        ssd = np.asarray(simulator.ssd_info[0], dtype=np.float64).ravel().tolist()
+    meta = {'kind': kind, 'pkeys': pkeys, 'xmin': xmin.tolist(), 'xmax': xmax.tolist(),
+            'tb': float(simulator.tb), 'dt': float(simulator.dt), 'si': float(simulator.si), 'quantiles': np.asarray(simulator.quantiles).tolist(),
+            'ssd': ssd, 'ntrials': int(simulator.ntot), 'nsamples': int(nsamples), 'seed': seed}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.rename(tmp, path)
+    return load_emulator(path, reload=True)
+
+def load_emulator(path, reload=False):
+    """ Emulator of the table at path, loaded once per process
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    if reload or path not in emulators:
+        emulators[path] = Emulator(path)
+    return emulators[path]
+
+
+class Emulator(object):
+    """ fast approximation of Simulator.sim_fx from a table of pre-simulated
+    yhats (see build_table). yhat at a parameter set is interpolated by a
+    weighted local linear fit to its k nearest design points (in coordinates
+    scaled to the bounds), averaging out the monte carlo noise of the table.
+    Meant for the global stage only (see Simulator.global_cost_fx), local
+    optimization always uses the exact simulator
+
+    Arguments:
+        path (str): table directory written by build_table()
+        k (int): number of design points per prediction (default: 2 * (len(pkeys) + 1))
+    """
+    def __init__(self, path, k=None):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.pkeys = self.meta['pkeys']
+        self.kind = self.meta['kind']
+        self.xmin = np.array(self.meta['xmin'])
+        self.xspan = np.array(self.meta['xmax']) - self.xmin
+        self.X = np.load(os.path.join(path, 'X.npy'), mmap_mode='r')
+        self.Y = np.load(os.path.join(path, 'Y.npy'), mmap_mode='r')
+        ndim = len(self.pkeys)
+        if k is None:
+            k = 2 * (ndim + 1)
+        self.k = min(k, self.X.shape[0])
+        self.U = (np.asarray(self.X) - self.xmin) / self.xspan
+        self.tree = cKDTree(self.U)
+        # keeps the local fit well posed when neighbors are nearly collinear
+        self.ridge = 1e-8 * np.eye(ndim + 1)
+
+    def matches(self, simulator):
+        """ True if the table was simulated for the same kind, tb,
+        dt, si, quantiles & ssds as a (flat) simulator (tables w/o dt & si
+        in their meta.json are never used)
+        """
+        meta = self.meta
+        if simulator.kind != self.kind or simulator.nlevels != 1:
+            return False
+        if simulator.y.size != self.Y.shape[1] or not np.isclose(simulator.tb, meta['tb']):
+            return False
+        if 'dt' not in meta or 'si' not in meta:
+            return False
+        if not np.isclose(simulator.dt, meta['dt']) or not np.isclose(simulator.si, meta['si']):
+            return False
+        if not np.allclose(np.asarray(simulator.quantiles), meta['quantiles']):
+            return False
+        if simulator.include_ss:
+            ssd = np.asarray(simulator.ssd_info[0], dtype=np.float64).ravel()
+            return meta['ssd'] is not None and np.allclose(ssd, meta['ssd'])
+        return meta['ssd'] is None
+
+    def covers(self, pkeys):
+        """ True if every parameter in pkeys is spanned by the table, i.e.,
+        yhat at a set of pkeys does not depend on params the table held fixed
+        (xb is only ignored for kinds w/o dynamic bias, see Simulator.vectorize_params)
+        """
+        ignored = [] if 'x' in self.kind else ['xb']
+        return all(pk in self.pkeys or pk in ignored for pk in pkeys)
+
+    def predict(self, X):
+        """ interpolated yhat (len(X), len(yhat)) at parameter values X (len(X), len(pkeys))
+        """
+        U = np.clip((np.atleast_2d(X) - self.xmin) / self.xspan, 0, 1)
+        # nan params give nan yhat (as sim_fx would)
+        finite = np.all(np.isfinite(U), axis=1)
+        U[~finite] = 0
+        dist, ix = self.tree.query(U, k=self.k)
+        # design matrix of each local fit, centered on the query point
+        A = np.concatenate([np.ones(ix.shape + (1,)), self.U[ix] - U[:, na, :]], axis=2)
+        # only the neighbors' rows are read from the memory-mapped table
+        Yk = self.Y[ix.ravel()].reshape(ix.shape + (-1,))
+        # neighbors w/ nan yhat (e.g., quantiles of sets w/ no responses)
+        # are left out of the fit of that element of yhat
+        valid = ~np.isnan(Yk)
+        Yk = np.where(valid, Yk, 0)
+        W = valid / (dist + 1e-12)[:, :, na]
+        AtA = np.einsum('qkj,qki,qkl->qjil', W, A, A) + self.ridge
+        AtY = np.einsum('qkj,qki->qji', W * Yk, A)
+        yhat = np.linalg.solve(AtA, AtY[..., na])[..., 0, 0]
+        # weighted mean where too few neighbors are left for a linear fit
+        nvalid, wsum = valid.sum(axis=1), W.sum(axis=1)
+        wmean = np.sum(W * Yk, axis=1) / np.where(wsum > 0, wsum, 1)
+        yhat = np.where(nvalid > A.shape[2], yhat, wmean)
+        nvalid[~finite] = 0
+        return np.where(nvalid > 0, yhat, np.nan)
+
+    def values(self, p):
+        """ values of pkeys in parameter dict p (VectorParams or not) """
+        return [np.mean(p[pk]) for pk in self.pkeys]
+
+    def sim_fx(self, p):
+        """ drop-in for Simulator.sim_fx (flat params) """
+        return self.predict(self.values(p))[0]
+
+    def batch_sim_fx(self, p_sets):
+        """ drop-in for Simulator.batch_sim_fx """
+        return self.predict([self.values(p) for p in p_sets])
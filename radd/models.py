@@ -1,6 +1,7 @@
 #!/usr/local/bin/env python
 from __future__ import division
 from copy import deepcopy
+from collections import OrderedDict
 import numpy as np
 from numpy import array
 from numpy.random import sample as rs
@@ -9,6 +10,12 @@ from numpy import newaxis as na
 from numpy import cumsum as csum
 from scipy.stats.mstats import mquantiles as mq
 from radd import theta
+from lmfit import Parameters as lmParameters
+
+class VectorParams(dict):
+    """ parameter dictionary with all values already vectorized
+    (see Simulator.vectorize_params), passed to simulate_* as is
+    """
 
 class Simulator(object):
     """ Core code for simulating models. All cond, trials, &
@@ -18,12 +25,18 @@ class Simulator(object):
         self.fitparams = fitparams
         self.pc_map = pc_map
         self.kind = kind
+        self.include_ss = False
         if 'ssd_info' in fitparams.keys():
             self.ssd_info = fitparams['ssd_info']
             self.include_ss=True
         if 'x' in self.kind:
             dynamic = True
         self.ntime = 0
+        # n timepoints simulated per step of first_crossing() (None: see get_tblock())
+        self.tblock = None
+        # memory budget (bytes) for each pass of batch_sim_fx(), small
+        # enough that the arrays walked by first_crossing() stay in cache
+        self.batch_bytes = 2**23
         self.dynamic = dynamic
         self.__update_steps__(dt=dt, si=si)
         self.update(fitparams=fitparams)
@@ -43,18 +56,71 @@ class Simulator(object):
         self.nlevels = fp['nlevels']
         self.ntot = fp['ntrials']
         self.quantiles = fp['quantiles']
+        # 'mc' (monte carlo traces), 'lattice' (exact go process) or
+        # 'smooth' (cost continuous in the parameters, see simulate_smooth())
+        self.engine = fp.get('engine', 'mc')
+        # bandwidth of smoothed steps (engine='smooth')
+        self.smooth_h = fp.get('smooth_h', .02)
+        # params & costs are float32, except for the smooth cost, whose
+        # finite-difference gradients need double precision
+        self.fdtype = np.float64 if self.engine=='smooth' else np.float32
+        # memory budget (bytes) for simulating trials in chunks
+        self.max_bytes = fp.get('max_bytes')
+        # float32 rvector, int8 steps & integer (lattice) positions
+        self.compact = fp.get('compact', False)
+        # bounded LRU cache of yhat vectors (see cached_sim_fx())
+        self.cache_size = fp.get('cache_size')
+        self.cache_bytes = fp.get('cache_bytes')
+        self.cache_decimals = fp.get('cache_decimals', 10)
+        self.clear_cache()
+        # variance reduction of rvector (see rand_uniform()) & stop accuracy
+        self.antithetic = fp.get('antithetic', False)
+        self.stratified = fp.get('stratified', False)
+        self.control_variate = fp.get('control_variate', False)
+        # approx. bytes allocated per trial & timepoint when simulating a chunk
+        self.cell_bytes = 64
+        if self.compact:
+            # int8 steps & int16 traces, but uniforms are drawn as float64 before
+            # the float32 cast and dpm stop traces are offset by float64 bases
+            self.cell_bytes = 32
+        if self.engine=='smooth':
+            # smoothed traces, crossing & survival probabilities are all float64
+            self.cell_bytes = 192
         # set empirical data, wts vectors
         self.y = fp['y'].flatten()
         self.wts = fp['wts'].flatten()
         # include SSD's if stop-signal task
         if self.include_ss:
             self.ssd_info = fp['ssd_info']
+        else:
+            self.pvc.remove('ssv')
         if self.nlevels>1:
             # remove any parameters free to vary across experimental conditions
             map((lambda pkey: self.pvc.remove(pkey)), list(self.pc_map))
+        # seeded, independent random streams (see stream_rng())
+        self.seed_seq = None
+        if fp.get('seed') is not None:
+            self.seed_seq = fp['seed']
+            if not isinstance(self.seed_seq, np.random.SeedSequence):
+                self.seed_seq = np.random.SeedSequence(fp['seed'])
+        # seeded streams are drawn in fixed blocks of rblock trials (see draw_trials())
+        self.rblock = 128
+        # stop process gets its own stream (else stop traces reuse go rvector)
+        self.stop_stream = self.seed_seq is not None and self.include_ss
+        if self.seed_seq is not None:
+            # longest possible trials (tr=0) up front, so yhat does not
+            # depend on what was simulated before (as in parallel.init_worker)
+            self.ntime = max(self.ntime, int(np.ceil(self.tb / self.dt)))
         self.__update_rand_vectors__()
         self.__init_model_functions__()
         self.__init_analyze_functions__()
+        # pre-simulated table used by the global stage (see radd.emulator)
+        self.emulator = None
+        if fp.get('emulator') is not None:
+            from radd.emulator import load_emulator
+            emulator = load_emulator(fp['emulator'])
+            if emulator.matches(self):
+                self.emulator = emulator
 
     def __update_steps__(self, dt=None, si=None, tb=None):
         """ update and store stepsize parameters
@@ -92,25 +158,175 @@ class Simulator(object):
         px = self.chunk(x, self.nlevels)
         for i, pk in enumerate(self.basin_keys):
             p[pk] = px[i]
-        # simulate using filled params dictionary
-        yhat = self.sim_fx(p)
+        # simulate (or emulate) using filled params dictionary
+        if self.emulates(p):
+            yhat = self.emulator.sim_fx(p)
+        else:
+            yhat = self.cached_sim_fx(p)
         # calculate and return cost error
-        return np.sum((self.wts * (yhat - self.y))**2).astype(np.float32)
+        return np.sum(self.residuals(yhat)**2).astype(self.fdtype)
 
     def cost_fx(self, theta, sse=False):
         """ Main cost function used for fitting all models self.sim_fx
         determines which model is simulated (determined when Simulator
         is initiated)
         """
-        if type(theta) == dict:
+        # lmfit Parameters subclass dict, so check for them first
+        if isinstance(theta, lmParameters):
+            p = theta.valuesdict()
+        else:
             p = dict(deepcopy(theta))
+        yhat = self.cached_sim_fx(p)
+        residuals = self.residuals(yhat)
+        if sse:
+            return np.sum(residuals**2).astype(self.fdtype)
+        return residuals.astype(self.fdtype)
+
+    def cached_sim_fx(self, p):
+        """ sim_fx(p) with a bounded LRU cache of yhat vectors, keyed on parameter
+        values rounded to cache_decimals. Set cache_size (max entries) and/or
+        cache_bytes (max bytes of cached yhats) in fitparams to turn on. The cache
+        is emptied whenever fitparams are updated or rvector is redrawn, so (with
+        common random numbers) a hit returns exactly what sim_fx would
+        """
+        if self.cache_size is None and self.cache_bytes is None:
+            return self.sim_fx(p)
+        key = tuple((pk, np.round(self.param_values(p[pk]), self.cache_decimals).tobytes()) for pk in sorted(p))
+        if key in self.cache:
+            self.cache_hits += 1
+            # move to most recently used
+            yhat = self.cache.pop(key)
+            self.cache[key] = yhat
+            return yhat.copy()
+        self.cache_misses += 1
+        yhat = self.sim_fx(p)
+        self.cache[key] = yhat.copy()
+        self.cache_nbytes += yhat.nbytes
+        while len(self.cache) and ((self.cache_size is not None and len(self.cache) > self.cache_size) or (self.cache_bytes is not None and self.cache_nbytes > self.cache_bytes)):
+            # evict least recently used
+            self.cache_nbytes -= self.cache.popitem(last=False)[1].nbytes
+        return yhat
+
+    def param_values(self, val):
+        """ float64 array of a parameter value (float, array or lmfit Parameter) """
+        if hasattr(val, 'value'):
+            val = val.value
+        return np.asarray(val, dtype=np.float64)
+
+    def clear_cache(self):
+        """ empty the yhat cache used by cached_sim_fx() and reset hit/miss counts
+        """
+        self.cache = OrderedDict()
+        self.cache_nbytes, self.cache_hits, self.cache_misses = 0, 0, 0
+
+    def cache_info(self):
+        """ hit/miss statistics and size of the cached_sim_fx() cache
+        """
+        ncalls = self.cache_hits + self.cache_misses
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'hit_rate': self.cache_hits / max(ncalls, 1), 'entries': len(self.cache), 'nbytes': self.cache_nbytes}
+
+    def residuals(self, yhat):
+        """ weighted residuals of yhat (or of each row of yhats) from y. Quantiles
+        of empty rt distributions (nan, see hist_quantiles()) are scored as 0, so
+        costs stay finite and sets that predict no responses are penalized
+        """
+        residuals = self.wts * (np.where(np.isnan(yhat), 0, yhat) - self.y)
+        # elements of y that are nan (no observed responses) are not scored
+        return np.where(np.isnan(residuals), 0, residuals)
+
+    def emulates(self, p):
+        """ True if yhat at parameter dict p can be read from the emulator
+        table, i.e., a matching table is set and it spans every param in p
+        """
+        return self.emulator is not None and self.emulator.covers(list(p))
+
+    def batch_cost_fx(self, p_sets, sse=True):
+        """ cost function for a list of parameter dictionaries
+        (see batch_sim_fx()), returns one cost per parameter set. Used to
+        screen/evolve sets in the global stage, so yhats are emulated if
+        an emulator table is set (fitparams['emulator'])
+        """
+        if self.emulates(p_sets[0]):
+            yhats = self.emulator.batch_sim_fx(p_sets)
         else:
-            p = theta.valuesdict()
-        yhat = self.sim_fx(p, analyze=True)
-        residuals = array(self.wts * (yhat - self.y))
+            yhats = self.batch_sim_fx(p_sets)
+        residuals = self.residuals(yhats)
         if sse:
-            return np.sum(residuals**2).astype(np.float32)
-        return residuals.astype(np.float32)
+            return np.sum(residuals**2, axis=1).astype(self.fdtype)
+        return residuals.astype(self.fdtype)
+
+    def batch_sim_fx(self, p_sets):
+        """ simulate yhat for a list of parameter dictionaries. Parameter sets
+        are stacked along the level axis (all sharing the same rvector) and
+        simulated together, batch_size() sets at a time
+        ::Arguments::
+            p_sets (list):
+                list of parameter dictionaries
+        ::Returns::
+            yhats (ndarray):
+                yhat vector for each parameter set (len(p_sets), len(yhat))
+        """
+        nbatch = self.batch_size()
+        yhats = [self.__simulate_batch__(p_sets[i:i+nbatch]) for i in range(0, len(p_sets), nbatch)]
+        return np.vstack(yhats)
+
+    def batch_size(self):
+        """ number of parameter sets simulated together in batch_sim_fx(),
+        chosen so one pass fits in batch_bytes (and max_bytes if set)
+        """
+        budget = self.batch_bytes
+        if self.max_bytes is not None:
+            budget = min(budget, self.max_bytes)
+        tblock = self.tblock
+        if tblock is None:
+            tblock = self.get_tblock(self.ntime, stacked=True)
+        set_bytes = self.nlevels * self.ntot * (tblock + 1) * self.cell_bytes
+        return int(max(1, budget // set_bytes))
+
+    def __simulate_batch__(self, p_sets):
+        """ stack vectorized p_sets into a single VectorParams dict
+        (nsets*nlevels values per parameter) and simulate yhat for all sets
+        """
+        nsets, nl = len(p_sets), self.nlevels
+        vsets = [self.vectorize_params(dict(deepcopy(p))) for p in p_sets]
+        p = VectorParams({pk: hs([vp[pk] for vp in vsets]) for pk in list(vsets[0])})
+        yhat = self.sim_fx(p)
+        if self.include_ss:
+            return yhat.reshape(nsets, -1)
+        # proactive yhat is [gacc (all levels), gq (all levels)]
+        gacc, gq = yhat[:nsets*nl].reshape(nsets, nl), yhat[nsets*nl:].reshape(nsets, -1)
+        return np.hstack([gacc, gq])
+
+    def level_index(self, p):
+        """ level (of rvector and ssd_info) simulated by each element of
+        vectorized params, p may hold several stacked parameter sets
+        """
+        return np.arange(len(p['a'])) % self.nlevels
+
+    def level_yhat_index(self, level):
+        """ elements of yhat (and y, wts) that depend only on the
+        params of one level: [gacc, sacc, gq, eq] of the level if
+        include_ss, else its gacc and gq (see analyze_proactive())
+        """
+        nl, ny = self.nlevels, self.y.size
+        if self.include_ss:
+            nper = ny // nl
+            return np.arange(level * nper, (level + 1) * nper)
+        nq = (ny - nl) // nl
+        return np.hstack([level, nl + level * nq + np.arange(nq)])
+
+    def level_fitparams(self, level):
+        """ fitparams of a flat (nlevels=1) fit to one level of the
+        current fit: its y & wts elements and its row of ssd_info
+        """
+        fp = dict(deepcopy(self.fitparams))
+        ix = self.level_yhat_index(level)
+        fp['nlevels'] = 1
+        fp['y'], fp['wts'] = self.y[ix], self.wts[ix]
+        if self.include_ss:
+            ssd, nssd, nss, nss_per, ssd_ix = self.ssd_info
+            fp['ssd_info'] = [ssd[level:level+1], nssd, nss, nss_per, ssd_ix[level:level+1]]
+        return fp
 
     def __init_model_functions__(self):
         """ initiates the simulation function used in
@@ -125,11 +341,15 @@ class Simulator(object):
         elif 'irace' in self.kind:
             self.sim_fx = self.simulate_irace
             self.analyze_fx = self.analyze_reactive
+        if self.engine=='lattice':
+            self.sim_fx = self.simulate_lattice
+        elif self.engine=='smooth':
+            self.sim_fx = self.simulate_smooth
         # dynamic bias is hyperbolic cosine
         if self.dynamic:
             self.dynamics_fx = lambda p, t: np.cosh(p['xb'][:, na] * t)
         else:
-            self.dynamics_fx = lambda p, t: np.ones((self.nlevels, len(t)))
+            self.dynamics_fx = lambda p, t: np.ones((len(p['a']), len(t)))
 
     def __init_analyze_functions__(self):
         """ initiates the analysis function used in
@@ -161,7 +381,9 @@ class Simulator(object):
             p (dict):
                 dictionary with all parameters as vectors
         """
-        nl_ones = np.ones(self.nlevels).astype(np.float32)
+        if isinstance(p, VectorParams):
+            return p
+        nl_ones = np.ones(self.nlevels).astype(self.fdtype)
         if 'si' in list(p):
             self.dx = np.sqrt(p['si'] * self.dt)
         if 'xb' not in list(p):
@@ -175,17 +397,282 @@ class Simulator(object):
             if pkc[0] not in list(p):
                 p[pkey] = p[pkey] * nl_ones
             else:
-                p[pkey] = array([p[pc] for pc in pkc]).astype(np.float32)
+                p[pkey] = array([p[pc] for pc in pkc]).astype(self.fdtype)
         return p
 
     def __update_rand_vectors__(self):
-        """ update rvector (random_floats) for Go and Stop traces
+        """ update rvector (random_floats) for Go and Stop traces.
+        If max_bytes is set, rvector is not stored. Instead, a seed is drawn
+        and each chunk of trials is regenerated on demand (see rand_trials()).
+        If seeded (fitparams['seed']), rvector is drawn from independent streams
+        (see stream_rng()) and redrawing for a longer ntime keeps the earlier timepoints.
+        Seeded or chunked, trials are drawn in fixed blocks (see draw_trials()),
+        so yhat does not depend on chunksize
         """
         nl, ntot, ntime = self.nlevels, self.ntot, self.ntime
-        self.rvector = rs((nl, ntot, ntime))
+        # cached yhats were simulated on the old rvector
+        self.cache = OrderedDict()
+        self.cache_nbytes = 0
+        self.chunksize = ntot
+        self.rdtype, self.walk_dtype = np.float64, np.float64
+        if self.compact:
+            self.rdtype = np.float32
+            self.walk_dtype = np.int16 if ntime < 2**15 else np.int32
+        if self.max_bytes is not None:
+            self.chunksize = self.get_chunksize(ntot)
+            if self.seed_seq is None:
+                self.rseed = np.random.randint(0, 2**30)
+            self.rvector, self.sbuffer = None, None
+            return
+        self.rvector = self.draw_trials(0, ntot)
+        # rvector is a view of the first ntot trials in rbuffer (see set_ntrials())
+        self.rbuffer = self.rvector
+        self.sbuffer = None
+        if self.stop_stream:
+            self.sbuffer = self.draw_trials(1, self.ssd_info[2])
+        self.__update_ss_view__()
+
+    def get_chunksize(self, ntrials):
+        """ n trials simulated per chunk so a chunk fits in max_bytes, rounded down
+        to a multiple of rblock (if larger) so each block of rvector is drawn once
+        """
+        chunk_trial_bytes = self.nlevels * max(self.ntime, 1) * self.cell_bytes
+        chunksize = int(np.clip(self.max_bytes // chunk_trial_bytes, 1, ntrials))
+        if self.rblock < chunksize < ntrials:
+            chunksize -= chunksize % self.rblock
+        return chunksize
+
+    def __update_ss_view__(self):
+        """ rvector_ss (nlevels, nSSD, ntrials_perssd, ntimepoints): stop trials
+        of the stop stream (if seeded) or the first nss trials of rvector
+        """
+        if self.include_ss:
+            ssd, nssd, nss, nss_per, ssd_ix = self.ssd_info
+            rv = self.rvector if self.sbuffer is None else self.sbuffer
+            self.rvector_ss = rv[:, :nss, :].reshape(self.nlevels, nssd, nss_per, -1)
+
+    def child_seq(self, *key):
+        """ SeedSequence of the child of seed_seq w/ spawn_key extended by key,
+        the same for a given seed & key regardless of what was drawn before
+        """
+        ss = self.seed_seq
+        return np.random.SeedSequence(ss.entropy, spawn_key=tuple(ss.spawn_key) + key, pool_size=ss.pool_size)
+
+    def stream_rng(self, stream, level, block=0):
+        """ Generator for one block of rblock trials of one level of a random
+        stream (0: go, 1: stop). Each (stream, level, block) is an independent
+        child of seed_seq (see child_seq())
+        """
+        return np.random.Generator(np.random.PCG64(self.child_seq(stream, level, block)))
+
+    def draw_trials(self, stream, ntrials, start=0):
+        """ uniforms (nlevels, ntrials, ntimepoints) for trials start:start+ntrials
+        of a stream, or from the global RNG if not seeded (& not chunked). Seeded
+        streams (and chunks regenerated from rseed) are drawn one whole block of
+        rblock trials at a time (see stream_rng()), so each trial gets the same
+        uniforms however trials are chunked (max_bytes) or grown (set_ntrials())
+        """
+        rv = np.empty((self.nlevels, ntrials, self.ntime), dtype=self.rdtype)
+        if self.seed_seq is None and self.max_bytes is None:
+            for i in range(self.nlevels):
+                rv[i] = self.rand_uniform(ntrials, self.ntime)
+            return rv
+        nb, stop = self.rblock, start + ntrials
+        for block in range(start // nb, (stop - 1) // nb + 1):
+            lo, hi = max(start, block * nb), min(stop, (block + 1) * nb)
+            if self.seed_seq is None:
+                rng = np.random.Generator(np.random.PCG64(self.rseed + block))
+            for i in range(self.nlevels):
+                if self.seed_seq is not None:
+                    rng = self.stream_rng(stream, i, block)
+                u = self.rand_uniform(nb, self.ntime, rng=rng)
+                rv[i, lo - start:hi - start] = u[lo - block * nb:hi - block * nb]
+        return rv
+
+    def rand_uniform(self, ntrials, ntime, rng=np.random):
+        """ uniform random floats (ntrials, ntime) for one level of rvector.
+        If stratified (fitparams), the values at each timepoint fall one in each
+        of ntrials equal strata of [0, 1) (in random trial order). If antithetic,
+        trials come in pairs (u, 1-u) that step in opposite directions whenever
+        the other steps with probability ~.5, so the pair's outcomes are negatively
+        correlated. Both reduce the monte carlo variance of yhat (see yhat_variance())
+        """
+        n = ntrials
+        if self.antithetic:
+            n = (ntrials + 1) // 2
+        if isinstance(rng, np.random.RandomState) or rng is np.random:
+            if self.stratified:
+                u = (np.argsort(rng.random_sample((ntime, n)), axis=1).T + rng.random_sample((n, ntime))) / n
+            else:
+                u = rng.random_sample((n, ntime))
+        else:
+            # seeded streams are drawn time-major, so a longer ntime keeps the earlier timepoints
+            k = 2 if self.stratified else 1
+            r = rng.random((ntime, k * n)).T
+            u = r[-n:]
+            if self.stratified:
+                u = (np.argsort(r[:n], axis=0) + u) / n
+        if self.antithetic:
+            # pairs are adjacent, so any even prefix of trials (see set_ntrials())
+            # or group of stop trials holds whole pairs
+            u = np.stack([u, 1 - u], axis=1).reshape(2 * n, ntime)[:ntrials]
+        return u
+
+    def resample_yhats(self, p, nreps=20):
+        """ yhat at parameters p (nreps, len(yhat)) simulated on nreps independent
+        draws of rvector, given the current ntrials and variance reduction
+        (antithetic/stratified/control_variate). rvector is restored afterwards
+        """
+        # simulate once so ntime (and rvector) cover p before saving rvector
+        self.sim_fx(dict(deepcopy(p)))
+        keys = ['rvector', 'rbuffer', 'sbuffer', 'rvector_ss', 'rseed', 'ntime', 'seed_seq']
+        saved = {key: getattr(self, key) for key in keys if hasattr(self, key)}
+        yhats = []
+        for i in range(nreps):
+            if saved['seed_seq'] is not None:
+                # reps draw from their own children of the seed (stream 2)
+                self.seed_seq = saved['seed_seq']
+                self.seed_seq = self.child_seq(2, i)
+            self.__update_rand_vectors__()
+            yhats.append(self.sim_fx(dict(deepcopy(p))))
+        for key, val in saved.items():
+            setattr(self, key, val)
+        self.clear_cache()
+        return np.vstack(yhats)
+
+    def yhat_variance(self, p, nreps=20):
+        """ monte carlo variance of yhat (and of its cost) at parameters p
+        across nreps independent draws of rvector (see resample_yhats())
+        ::Arguments::
+            p (dict):
+                parameter dictionary
+            nreps (int):
+                number of rvector draws
+        ::Returns::
+            yvar (ndarray):
+                variance of each element of yhat (nan where yhat was nan on any draw)
+            fvar (float):
+                variance of the cost (sse)
+        """
+        yhats = self.resample_yhats(p, nreps=nreps)
+        fmins = np.sum(self.residuals(yhats)**2, axis=1)
+        return yhats.var(axis=0), fmins.var()
+
+    def noise_floor(self, p, nreps=20, target=.05):
+        """ monte carlo noise of the cost at parameters p (e.g., the best fit) and
+        the smallest ntrials that keeps the cost sd below target * cost. Noise sd
+        shrinks as 1/sqrt(ntrials), so it is extrapolated from the current ntrials
+        ::Arguments::
+            p (dict):
+                parameter dictionary
+            nreps (int):
+                number of rvector draws (see resample_yhats())
+            target (float):
+                max cost sd, relative to the cost (chi) at p
+        ::Returns::
+            noise (dict):
+                ntrials, cost (mean), cost_sd, rel_sd (cost_sd / cost),
+                yhat_sd (sd of each element of yhat) & ntrials_min (recommended ntrials)
+        """
+        yhats = self.resample_yhats(p, nreps=nreps)
+        fmins = np.sum(self.residuals(yhats)**2, axis=1)
+        cost, cost_sd = np.mean(fmins), np.std(fmins, ddof=1)
+        rel_sd = cost_sd / cost if cost > 0 else np.inf
+        # keep ntrials a multiple of the stop trial layout (& of antithetic pairs)
+        unit = 2
         if self.include_ss:
+            unit = 2 * self.ssd_info[1]
+        ntrials_min = self.ntot * (rel_sd / target)**2
+        ntrials_min = int(max(np.ceil(ntrials_min / unit), 1) * unit) if np.isfinite(ntrials_min) else None
+        return {'ntrials': self.ntot, 'cost': cost, 'cost_sd': cost_sd, 'rel_sd': rel_sd, 'yhat_sd': yhats.std(axis=0, ddof=1), 'ntrials_min': ntrials_min}
+
+    def coarsest_dt(self, p, noise, target=.05, nreps=20, factors=(2, 4)):
+        """ largest dt (current dt times one of factors) that shifts the mean cost
+        at p by less than target * cost (beyond 2 standard errors of the monte carlo
+        noise), at the current ntrials. Coarser dt is proportionally cheaper to simulate
+        ::Arguments::
+            p (dict):
+                parameter dictionary
+            noise (dict):
+                noise_floor() at p (mean & sd of the cost at the current dt)
+            factors (tuple):
+                coarser dt to try (in order), relative to the current dt
+        ::Returns::
+            dt (float): recommended dt (the current dt if no coarser dt qualifies)
+        """
+        fp = dict(self.fitparams)
+        fp['ntrials'] = self.ntot
+        if self.include_ss:
+            fp['ssd_info'] = self.ssd_info
+        dt = self.dt
+        for factor in factors:
+            sim = Simulator(fitparams=fp, pc_map=self.pc_map, kind=self.kind, dt=self.dt * factor, si=self.si)
+            sim.y, sim.wts = self.y, self.wts
+            fmins = np.sum(sim.residuals(sim.resample_yhats(p, nreps=nreps))**2, axis=1)
+            shift = np.abs(fmins.mean() - noise['cost'])
+            se = np.sqrt((fmins.var(ddof=1) + noise['cost_sd']**2) / nreps)
+            if shift - 2 * se > target * noise['cost']:
+                break
+            dt = self.dt * factor
+        return dt
+
+    def set_ntrials(self, ntrials):
+        """ change the number of simulated trials (fidelity) without redrawing
+        rvector: fewer trials use the first ntrials of the random buffer and
+        more trials only draw the trials not already in the buffer
+        ::Arguments::
+            ntrials (int):
+                number of trials to simulate for each level
+        """
+        ntrials = int(ntrials)
+        if ntrials==self.ntot:
+            return
+        self.ntot = ntrials
+        self.cache = OrderedDict()
+        self.cache_nbytes = 0
+        if self.include_ss:
+            # same stop trial layout as RADDCore.__set_ssd_info__
             ssd, nssd, nss, nss_per, ssd_ix = self.ssd_info
-            self.rvector_ss=self.rvector[:, :nss, :].reshape(nl, nssd, nss_per, ntime)
+            nss = int(.5 * ntrials)
+            self.ssd_info = [ssd, nssd, nss, int(nss / nssd), ssd_ix]
+        if self.rvector is None:
+            self.chunksize = self.get_chunksize(ntrials)
+            return
+        nbuffer = self.rbuffer.shape[1]
+        if ntrials > nbuffer:
+            self.rbuffer = np.concatenate([self.rbuffer, self.draw_trials(0, ntrials - nbuffer, start=nbuffer)], axis=1)
+        self.rvector = self.rbuffer[:, :ntrials]
+        if self.sbuffer is not None and self.ssd_info[2] > self.sbuffer.shape[1]:
+            nbuffer = self.sbuffer.shape[1]
+            self.sbuffer = np.concatenate([self.sbuffer, self.draw_trials(1, self.ssd_info[2] - nbuffer, start=nbuffer)], axis=1)
+        self.chunksize = ntrials
+        self.__update_ss_view__()
+
+    def rand_trials(self, start, stop, stream=0):
+        """ get rvector (nlevels, stop-start, ntimepoints) for trials start:stop,
+        regenerating it (see draw_trials()) if rvector is not stored. stream=1
+        gets stop trials of the stop stream (only used if seeded)
+        """
+        if self.rvector is not None:
+            if stream==1:
+                return self.sbuffer[:, start:stop]
+            return self.rvector[:, start:stop]
+        return self.draw_trials(stream, stop - start, start)
+
+    def get_rand_vectors(self):
+        """ get rvector & rvector_ss for all trials (Go and Stop traces)
+        """
+        if self.rvector is not None:
+            if self.include_ss:
+                return self.rvector, self.rvector_ss
+            return self.rvector, None
+        rvector = self.rand_trials(0, self.ntot)
+        rvector_ss = None
+        if self.include_ss:
+            ssd, nssd, nss, nss_per, ssd_ix = self.ssd_info
+            rv = self.rand_trials(0, nss, stream=1) if self.stop_stream else rvector
+            rvector_ss = rv[:, :nss, :].reshape(self.nlevels, nssd, nss_per, self.ntime)
+        return rvector, rvector_ss
 
     def __update_trace_params__(self, p):
         """ update Pg (probability of DVg +dx) and Tg (n timepoints)
@@ -207,9 +694,9 @@ class Simulator(object):
         """ update Ps (probability of DVs +dx) and Ts (n timepoints)
         for condition and each SSD of stop process
         """
-        ssd = self.ssd_info[0]
+        ssd = self.ssd_info[0][self.level_index(p)]
         if 'sso' in list(p):
-            sso = p['sso']
+            sso = p['sso'][:, na]
         Ps = 0.5 * (1 + p['ssv'] * self.dx / self.si)
         Ts = np.ceil((self.tb - (ssd + sso)) / self.dt).astype(int)
         ss_on = 0
@@ -231,18 +718,20 @@ class Simulator(object):
             or list of decision traces (list of ndarrays)
         """
         p = self.vectorize_params(p)
+        Pg, Ps, ss_on = self.__update_trace_params__(p)
+        if analyze:
+            gdec, sdec = self.simulate_decisions(p, Pg, Ps, ss_on)
+            return self.analyze_fx(gdec, sdec, p)
         nl, ntot, dx = self.nlevels, self.ntot, self.dx
         ssd, nssd, nss, nss_per, ssd_ix = self.ssd_info
-        Pg, Ps, ss_on = self.__update_trace_params__(p)
+        rvector, rvector_ss = self.get_rand_vectors()
         # generate Go traces (nlevels, ntrials, ntimepoints)
-        DVg = self.xtb[:,na] * csum(np.where(self.rvector.T < Pg, dx, -dx).T, axis=2)
+        DVg = self.xtb[:,na] * csum(np.where(rvector.T < Pg, dx, -dx).T, axis=2)
         ssDVg = DVg[:, :nss, :].reshape(nl, nssd, nss_per, DVg.shape[-1])
         # use array-indexing to initialize SS at DVg[:nlevels, :ssd, :trials, t=SSD]
         ssBase = ssDVg[np.arange(nl)[:,na], ssd_ix, :, ss_on][:,:,:,na]
         # add ssBaseline to SS traces (nlevels, nSSD, ntrials_perssd, ntimepoints)
-        DVs = ssBase + csum(np.where(self.rvector_ss.T < Ps, dx, -dx).T, axis=3)
-        if analyze:
-            return self.analyze_fx(DVg, DVs, p)
+        DVs = ssBase + csum(np.where(rvector_ss.T < Ps, dx, -dx).T, axis=3)
         return [DVg, DVs]
 
     def simulate_irace(self, p, analyze=True):
@@ -250,15 +739,16 @@ class Simulator(object):
         (see simulate_dpm() for I/O details)
         """
         p = self.vectorize_params(p)
-        nl, ntot, dx = self.nlevels, self.ntot, self.dx
-        ssd, nssd, nss, nss_per, ssd_ix = self.ssd_info
         Pg, Ps, ss_on = self.__update_trace_params__(p)
+        if analyze:
+            gdec, sdec = self.simulate_decisions(p, Pg, Ps, ss_on)
+            return self.analyze_fx(gdec, sdec, p)
+        nl, ntot, dx = self.nlevels, self.ntot, self.dx
+        rvector, rvector_ss = self.get_rand_vectors()
         # generate Go traces (nlevels, ntrials, ntimepoints)
-        DVg = self.xtb[:,na] * csum(np.where(self.rvector.T < Pg, dx, -dx).T, axis=2)
+        DVg = self.xtb[:,na] * csum(np.where(rvector.T < Pg, dx, -dx).T, axis=2)
         # generate SS traces (nlevels, nSSD, ntrials_perssd, ntimepoints)
-        DVs = csum(np.where(self.rvector_ss.T < Ps, dx, -dx).T, axis=3)
-        if analyze:
-            return self.analyze_fx(DVg, DVs, p)
+        DVs = csum(np.where(rvector_ss.T < Ps, dx, -dx).T, axis=3)
         return [DVg, DVs]
 
     def simulate_pro(self, p, analyze=True):
@@ -266,44 +756,541 @@ class Simulator(object):
         (see simulate_dpm() for I/O details)
         """
         p = self.vectorize_params(p)
+        Pg = self.__update_trace_params__(p)[0]
+        if analyze:
+            gdec, sdec = self.simulate_decisions(p, Pg)
+            return self.analyze_fx(gdec, p)
         nl, ntot, dx = self.nlevels, self.ntot, self.dx
-        Pg = self.__update_trace_params__(p)
+        rvector, rvector_ss = self.get_rand_vectors()
         # generate Go traces (nlevels, ntrials, ntimepoints)
-        DVg = self.xtb[:,na] * csum(np.where(self.rvector.T < Pg, dx, -dx).T, axis=2)
-        if analyze:
-            return self.analyze_fx(DVg, p)
+        DVg = self.xtb[:,na] * csum(np.where(rvector.T < Pg, dx, -dx).T, axis=2)
         return DVg
 
-    def analyze_reactive(self, DVg, DVs, p):
+    def simulate_decisions(self, p, Pg, Ps=None, ss_on=0, ntrials=None):
+        """ simulate Go (and Stop) processes one chunk of trials at a time (see
+        __update_rand_vectors__) and get the index of the first boundary crossing
+        on each trial (see first_crossing()). The dynamic bias is folded into the
+        go boundary (xtb*DVg >= a <--> DVg >= a/xtb) so traces are never scaled
+        ::Arguments::
+            p (dict):
+                vectorized parameter dictionary (may hold several stacked
+                parameter sets, see batch_sim_fx())
+            Pg, Ps, ss_on:
+                see __update_trace_params__()
+            ntrials (int):
+                simulate only the first ntrials (default: all trials)
+        ::Returns::
+            gdec (ndarray):
+                go crossing indices (nlevels, ntrials)
+            sdec (ndarray):
+                stop crossing indices (nlevels, nSSD, ntrials_perssd)
+                None if model does not include stop process
+        """
+        nl, dx = len(Pg), self.dx
+        if ntrials is None:
+            ntrials = self.ntot
+        nss = 0
+        # boundaries in trace units (k*dx --> k if compact)
+        unit = 1.
+        if self.compact:
+            unit = 1. / dx
+        gbound = unit * p['a'][:, na] / self.xtb
+        if self.include_ss:
+            ssd, nssd, nss, nss_per, ssd_ix = self.ssd_info
+            # index of the SSD used on each stop trial
+            trial_ssd = np.arange(nss) // nss_per
+            sbound = np.zeros_like(gbound)
+            if 'irace' in self.kind:
+                sbound = unit * p['a'][:, na] * np.ones_like(gbound)
+        gdec, sdec = [], []
+        for start in range(0, ntrials, self.chunksize):
+            stop = min(start + self.chunksize, ntrials)
+            rv = self.rand_trials(start, stop)
+            nchunk_ss = max(min(stop, nss) - start, 0)
+            on = None
+            if nchunk_ss and 'dpm' in self.kind:
+                on = ss_on[:, trial_ssd[start:start + nchunk_ss]]
+            gix, DVon = self.first_crossing(rv, Pg, gbound, at=on)
+            gdec.append(gix)
+            if not nchunk_ss:
+                continue
+            ssBase = None
+            if on is not None:
+                # initialize SS at DVg(t=ss_on), only simulating Go up to ss_on
+                # unless first_crossing() already walked the whole go traces
+                if DVon is None:
+                    rvon = rv[self.level_index(p), :nchunk_ss, :on.max() + 1]
+                    DVg = csum(self.trace_steps(rvon.T < Pg).T, axis=2, dtype=self.walk_dtype)
+                    DVon = DVg[np.arange(nl)[:,na], np.arange(nchunk_ss), on]
+                ssBase = self.xtb[np.arange(nl)[:,na], on] * DVon
+            upper = 'irace' in self.kind
+            rvs = rv[:, :nchunk_ss]
+            if self.stop_stream:
+                rvs = self.rand_trials(start, start + nchunk_ss, stream=1)
+            sdec.append(self.first_crossing(rvs, Ps, sbound, base=ssBase, upper=upper)[0])
+        gdec = np.concatenate(gdec, axis=1)
+        if not sdec:
+            return gdec, None
+        sdec = np.concatenate(sdec, axis=1).reshape(nl, nssd, nss_per)
+        return gdec, sdec
+
+    def first_crossing(self, rv, P, bound, base=None, upper=True, at=None):
+        """ walk traces forward tblock timepoints at a time, retiring each trial
+        as soon as it crosses the boundary, so only traces still running are simulated.
+        If P holds several stacked parameter sets (see batch_sim_fx()), the sets
+        simulated on the same level of rv are walked together
+        ::Arguments::
+            rv (ndarray):
+                random floats (nlevels, ntrials, ntimepoints)
+            P (array):
+                probability of +dx step for each level (or each level of each set)
+            bound (ndarray):
+                boundary at each timepoint (len(P), ntimepoints)
+            base (ndarray):
+                starting point of each trace (len(P), ntrials), default is 0
+            upper (bool):
+                if True, trace crosses when >= bound, else when <= bound
+            at (ndarray):
+                timepoint index (len(P), n) at which to read the first n traces
+                (e.g., the go traces at the onset of dpm stop traces)
+        ::Returns::
+            ix (ndarray):
+                index of first crossing on each trial (len(P), ntrials),
+                0 if the trace never crosses (same as np.argmax convention)
+            values (ndarray):
+                traces (w/o base) at timepoints at, None if at is None or if traces
+                were walked in blocks (trials are retired once they cross)
+        """
+        nl, ntr, ntime = rv.shape
+        cross = np.greater_equal if upper else np.less_equal
+        ix = np.zeros((len(P), ntr), dtype=np.int64)
+        tblock = self.tblock
+        if tblock is None:
+            tblock = self.get_tblock(ntime, stacked=len(P) > nl)
+        values = None
+        if at is not None and tblock >= ntime:
+            values = np.empty(at.shape, dtype=self.walk_dtype)
+        for i in range(nl):
+            # row of level i in each stacked set (each set holds nl consecutive rows)
+            rows = np.arange(i, len(P), nl)
+            if tblock >= ntime:
+                # whole traces in one step, nothing to retire
+                steps = self.trace_steps(rv[i] < P[i::nl, na, na])
+                if self.compact:
+                    trace = csum(steps, axis=2, dtype=self.walk_dtype)
+                else:
+                    # in place, saves allocating (and paging in) another trace array
+                    trace = csum(steps, axis=2, out=steps)
+                if base is None:
+                    crossed = cross(trace, bound[i::nl, na, :])
+                else:
+                    crossed = cross(base[i::nl, :, na] + trace - bound[i::nl, na, :], 0)
+                ix[i::nl] = np.argmax(crossed, axis=2)
+                if values is not None:
+                    values[i::nl] = trace[:, np.arange(at.shape[1]), at[i::nl]]
+                continue
+            # (set, trial) pairs still running, all walked on the same rv[i]
+            row, active = np.repeat(rows, ntr), np.tile(np.arange(ntr), rows.size)
+            walk, offset = np.zeros(row.size, dtype=self.walk_dtype), None
+            if base is not None:
+                offset = base[row, active]
+            for t0 in range(0, ntime, tblock):
+                t1 = min(t0 + tblock, ntime)
+                if active.size==ntr and rows.size==1:
+                    rvblock = rv[i, :, t0:t1]
+                else:
+                    rvblock = rv[i, active, t0:t1]
+                if rows.size==1:
+                    Pi, bnd = P[rows[0]], bound[rows[0], t0:t1]
+                else:
+                    Pi, bnd = P[row][:, na], bound[row, t0:t1]
+                steps = self.trace_steps(rvblock < Pi)
+                if self.compact:
+                    trace = walk[:, na] + csum(steps, axis=1, dtype=self.walk_dtype)
+                else:
+                    # sum sequentially from walk (same rounding as one cumsum)
+                    steps[:, 0] += walk
+                    trace = csum(steps, axis=1)
+                if offset is None:
+                    crossed = cross(trace, bnd)
+                else:
+                    crossed = cross(offset[:, na] + trace - bnd, 0)
+                first = np.argmax(crossed, axis=1)
+                # argmax is 0 for rows that never cross (& for rows crossing at t0)
+                done = crossed[np.arange(first.size), first]
+                ix[row[done], active[done]] = t0 + first[done]
+                keep = ~done
+                if not keep.any():
+                    break
+                walk = trace[keep, -1]
+                row, active = row[keep], active[keep]
+                if offset is not None:
+                    offset = offset[keep]
+        return ix, values
+
+    def get_tblock(self, ntime, stacked=False):
+        """ n timepoints walked per step of first_crossing() when tblock is None.
+        Single parameter sets walk whole traces if they are short (retiring trials
+        only pays off when most of a long trace is left to walk), else ~ntime/8
+        timepoints per step. Stacked sets (batch_sim_fx()) walk 20 timepoints per
+        step, so their (much larger) blocks stay in cache
+        """
+        if stacked:
+            return min(ntime, 20)
+        if ntime <= 320:
+            return ntime
+        return int(np.ceil(ntime / 8.))
+
+    def trace_steps(self, up):
+        """ +dx/-dx steps where up is True/False, int8 +1/-1 steps if compact
+        """
+        # (exactly) +/-dx, several times faster than np.where(up, dx, -dx)
+        if self.compact:
+            return up.view(np.int8) * np.int8(2) - np.int8(1)
+        return up * (2 * self.dx) - self.dx
+
+    def analyze_reactive(self, gdec, sdec, p):
         """ get rt and accuracy of go and stop process for simulated
-        conditions generated from simulate_dpm
+        conditions generated from simulate_dpm (see rt_counts())
         """
-        ssd, nssd, nss, nss_per, ssd_ix = self.ssd_info
-        nl, ntot = self.nlevels, self.ntot
-        gdec = self.go_resp(DVg, p['a'])
-        # if dpm, simply ss_resp() uses 0
-        # as boundary simply ignores sec. arg
-        sdec = self.ss_resp(DVs, p['a'])
-        gort = self.go_RT(p['tr'], gdec)
-        ssrt = self.ss_RT(ssd, sdec)
-        ert = gort[:, :nss].reshape(nl, nssd, nss_per)
-        eq = self.RTQ(zip(ert, ssrt))
-        gq = self.RTQ(zip(gort, [self.tb] * nl))
-        gacc = np.nanmean(np.where(gort < self.tb, 1, 0), axis=1)
-        sacc = np.where(ert < ssrt, 0, 1).mean(axis=2)
+        nl = len(gdec)
+        counts, rt = self.rt_counts(gdec, p)
+        gacc = counts.sum(axis=1) / gdec.shape[1]
+        gq = self.hist_quantiles(counts, rt)
+        sacc, eq = self.analyze_stop(gdec, sdec, p)
         return hs([hs([i[ii] for i in [gacc, sacc, gq, eq]]) for ii in range(nl)])
 
-    def analyze_proactive(self, DVg, p):
+    def analyze_stop(self, gdec, sdec, p, gfpt=None):
+        """ get stop accuracy and error rt quantiles from go (gdec) and
+        stop (sdec) crossing indices on stop trials. A stop trial is an error
+        if the go process finishes (tr + gdec*dt) before the stop process
+        (ssd + sdec*dt), trials where either process never crosses are not.
+        If control_variate (fitparams), stop accuracy is corrected by the
+        go rts of the same stop trials (see stop_control_variate())
+        """
+        ssd, nssd, nss, nss_per, ssd_ix = self.ssd_info
+        nl, dt = len(gdec), self.dt
+        ssd = ssd[self.level_index(p)]
+        g = gdec[:, :nss].reshape(nl, nssd, nss_per)
+        err = (g > 0) & (sdec > 0) & (p['tr'][:, na, na] + g * dt < ssd[:, :, na] + sdec * dt)
+        if self.control_variate:
+            sacc = 1 - self.stop_control_variate(err, g, p, gfpt)
+        else:
+            sacc = 1 - err.mean(axis=2)
+        # error rts on the same grid as go rts (all SSDs pooled)
+        lvl = np.repeat(np.arange(nl), nssd * nss_per).reshape(err.shape)
+        counts = np.bincount(lvl[err] * self.ntime + g[err], minlength=nl * self.ntime)
+        rt = p['tr'][:, na] + np.arange(self.ntime) * dt
+        eq = self.hist_quantiles(counts.reshape(nl, self.ntime), rt)
+        return sacc, eq
+
+    def stop_control_variate(self, err, g, p, gfpt=None):
+        """ control variate estimate of the stop error rate (nlevels, nSSD). The go
+        rt of each stop trial (tb if no response) is simulated on the same traces as
+        the error, so it is strongly (negatively) correlated with it, and its mean is
+        known exactly from the go first-passage-time distribution (see go_fpt_lattice()).
+        The error rate at each SSD is corrected by the (regression) beta times the
+        difference between the simulated and exact mean go rt
+        """
+        if gfpt is None:
+            Pg = 0.5 * (1 + p['v'] * self.dx / self.si)
+            gfpt = self.go_fpt_lattice(Pg, p)
+        tr = p['tr'][:, na]
+        rt = tr + np.arange(self.ntime) * self.dt
+        # exact mean go rt (censored at tb, same conventions as rt_counts())
+        presp = np.where(rt < self.tb, gfpt, 0)
+        presp[:, 0] = 0
+        rt_mean = np.sum(presp * rt, axis=1) + (1 - presp.sum(axis=1)) * self.tb
+        grt = tr[:, :, na] + g * self.dt
+        grt = np.where((g > 0) & (grt < self.tb), grt, self.tb)
+        grt_dev = grt - grt.mean(axis=2)[:, :, na]
+        err_dev = err - err.mean(axis=2)[:, :, na]
+        grt_var = np.mean(grt_dev**2, axis=2)
+        beta = np.mean(grt_dev * err_dev, axis=2) / np.where(grt_var > 0, grt_var, 1)
+        return np.clip(err.mean(axis=2) - beta * (grt.mean(axis=2) - rt_mean[:, na]), 0, 1)
+
+    def analyze_proactive(self, gdec, p):
         """ get proactive rt and accuracy of go process for simulated
-        conditions generated from simulate_pro
+        conditions generated from simulate_pro (see rt_counts())
         """
-        nl, ntot = self.nlevels, self.ntot
-        gdec = self.go_resp(DVg, p['a'])
-        gort = self.go_RT(p['tr'], gdec)
-        gq = self.RTQ(zip(gort, [self.tb] * nl))
+        counts, rt = self.rt_counts(gdec, p)
+        gq = self.hist_quantiles(counts, rt)
         # Get response and stop accuracy information
-        gacc = 1 - np.mean(np.where(gort < self.tb, 1, 0), axis=1)
-        return hs([gacc, gq])
+        gacc = 1 - counts.sum(axis=1) / gdec.shape[1]
+        return hs([gacc, hs(gq)])
+
+    def rt_counts(self, gdec, p):
+        """ count go responses at each timepoint with one bincount over the
+        crossing indices of all levels. Simulated rts fall on the grid
+        tr + k*dt, so responses are the counts with k>0 and tr + k*dt < tb
+        ::Returns::
+            counts (ndarray):
+                n go responses at each timepoint (nlevels, ntimepoints)
+            rt (ndarray):
+                rt of each timepoint (nlevels, ntimepoints)
+        """
+        nl, ntime = len(gdec), self.ntime
+        rt = p['tr'][:, na] + np.arange(ntime) * self.dt
+        ix = gdec + (np.arange(nl) * ntime)[:, na]
+        counts = np.bincount(ix.ravel(), minlength=nl * ntime).reshape(nl, ntime)
+        counts[:, 0] = 0
+        counts[rt >= self.tb] = 0
+        return counts, rt
+
+    def hist_quantiles(self, counts, values):
+        """ quantiles of data stored as counts of each (sorted) value, using the
+        same plotting positions as scipy.stats.mstats.mquantiles (alphap=betap=.4)
+        ::Arguments::
+            counts (ndarray):
+                n observations of each value (nrows, nvalues)
+            values (ndarray):
+                values in ascending order along each row (nrows, nvalues)
+        ::Returns::
+            q (ndarray):
+                quantiles of each row (nrows, nquantiles), nan if row is empty
+        """
+        nrows, nv = counts.shape
+        prob = self.quantiles
+        n = counts.sum(axis=1)[:, na]
+        aleph = n * prob + (.4 + .2 * prob)
+        # np.clip(aleph, 1, n - 1) w/o its overhead on small arrays
+        k = np.floor(np.minimum(np.maximum(aleph, 1), n - 1))
+        gamma = np.minimum(np.maximum(aleph - k, 0), 1)
+        # value of the j'th (0-based) smallest observation is the first value where
+        # cumulative count > j (rows are offset so all rows are searched at once)
+        offset = np.arange(nrows)[:, na] * (n.max() + 1)
+        ccounts = (csum(counts, axis=1) + offset).ravel()
+        xj = lambda j: values.ravel()[np.minimum(np.searchsorted(ccounts, j + offset, side='right'), nrows * nv - 1)]
+        q = (1 - gamma) * xj(np.maximum(k - 1, 0)) + gamma * xj(k)
+        q[n[:, 0]==0] = np.nan
+        return q
+
+    def simulate_smooth(self, p, analyze=True):
+        """ simulate the model w/ a cost that is continuous (and differentiable) in
+        the parameters for a fixed rvector, so local optimization can use gradient based
+        (quasi-Newton) methods, e.g. set_fitparams(engine='smooth', method='lbfgsb').
+        Each source of jumps in the monte carlo simulation is smoothed:
+            steps: dx*tanh((P - u)/smooth_h) instead of +/-dx (~same mean step)
+            crossings: soft first crossing (see soft_crossing())
+            ssd onset and tb: go traces interpolated at the (non-integer) onset
+                timepoint of the stop process, responses ramped out over the last dt
+            accuracy & quantiles: expected n responses at each timepoint, quantiles
+                interpolated from their cumulative sum (see smooth_quantiles())
+        Traces are walked for all timepoints (not retired once they cross)
+        ::Arguments::
+            p (dict):
+                parameter dictionary
+            analyze (bool <True>):
+                if True (default) return rt and accuracy information
+                else, return go first-crossing probabilities (nlevels, ntrials, ntimepoints)
+        ::Returns::
+            yhat (ndarray) or go first-crossing probabilities
+        """
+        p = self.vectorize_params(p)
+        out = self.__update_trace_params__(p)
+        Pg, nl, dt, dx, h = out[0], len(p['a']), self.dt, self.dx, self.smooth_h
+        lvl = self.level_index(p)
+        rt = p['tr'][:, na] + np.arange(self.ntime) * dt
+        # responses before tb (ramped out over the last timestep), none at t=0
+        window = np.clip((self.tb - rt) / dt, 0, 1)
+        window[:, 0] = 0
+        counts, gfpts, nss = np.zeros((nl, self.ntime)), [], 0
+        if self.include_ss:
+            ssd, nssd, nss, nss_per, ssd_ix = self.ssd_info
+            Ps = out[1]
+            # index of the SSD used on each stop trial
+            trial_ssd = np.arange(nss) // nss_per
+            # (non-integer) go timepoint at which the stop process starts, negative
+            # if it starts before the go process (ssd + sso < tr), i.e. w/ a head start
+            sso = p['sso'][:, na] if 'sso' in list(p) else 0
+            onset = np.minimum((ssd[lvl] + sso - p['tr'][:, na]) / dt, self.ntime - 1)
+            li = np.arange(nl)[:, na]
+            perr_ssd = np.zeros((nl, nssd))
+            ecounts = np.zeros((nl, self.ntime))
+        # trials are simulated one chunk at a time (see simulate_decisions()),
+        # all outputs are sums over trials
+        for start in range(0, self.ntot, self.chunksize):
+            stop = min(start + self.chunksize, self.ntot)
+            rv = self.rand_trials(start, stop)
+            if nl!=self.nlevels:
+                rv = rv[lvl]
+            DVg = csum(dx * np.tanh((Pg[:, na, na] - rv) / h), axis=2)
+            gfpt = self.soft_crossing(DVg, (p['a'][:, na] / self.xtb)[:, na, :])[1]
+            if not analyze:
+                gfpts.append(gfpt)
+                continue
+            counts += np.sum(gfpt, axis=1)
+            n = max(min(stop, nss) - start, 0)
+            if not n:
+                continue
+            rvs = rv[:, :n]
+            if self.stop_stream:
+                rvs = self.rand_trials(start, start + n, stream=1)
+                if nl!=self.nlevels:
+                    rvs = rvs[lvl]
+            DVs = csum(dx * np.tanh((Ps[:, na, na] - rvs) / h), axis=2)
+            on_trial = onset[:, trial_ssd[start:start + n]]
+            if 'dpm' in self.kind:
+                # stop traces start at the (scaled) go trace of the same trial at onset
+                # (at its first timepoint if the stop process starts first, as ss_on)
+                on = np.maximum(on_trial, 0)
+                t0 = np.minimum(np.floor(on).astype(int), self.ntime - 2)
+                w = on - t0
+                G = DVg[:, :n] * self.xtb[:, na, :]
+                base = (1 - w) * G[li, np.arange(n), t0] + w * G[li, np.arange(n), t0 + 1]
+                # w/o dynamic bias, stop traces start on the lattice of the stop bound (0)
+                shift = .5 if 'x' in self.kind else 0
+                ssurv = self.soft_crossing(base[..., na] + DVs, 0, upper=False, shift=shift)[0]
+            else:
+                ssurv = self.soft_crossing(DVs, p['a'][:, na, na])[0]
+            # stop survival at each go timepoint: 1 before onset, interpolated after
+            # (the stop process has run t - onset timepoints at go timepoint t)
+            ts = np.arange(self.ntime)[na, na, :] - on_trial[:, :, na]
+            s0 = np.clip(np.floor(ts).astype(int), 0, self.ntime - 2)
+            ws = np.clip(ts - s0, 0, 1)
+            ix = (li[:, :, na], np.arange(n)[na, :, na])
+            sat = (1 - ws) * ssurv[ix + (s0,)] + ws * ssurv[ix + (s0 + 1,)]
+            sat = np.where(ts < 0, 1., sat)
+            # error: go crosses (at t>0) before the stop process, which crosses later on
+            perr = gfpt[:, :n, 1:] * (sat[..., 1:] - ssurv[..., -1:])
+            np.add.at(perr_ssd, (li, trial_ssd[na, start:start + n]), perr.sum(axis=2))
+            ecounts[:, 1:] += perr.sum(axis=1)
+        if not analyze:
+            return np.concatenate(gfpts, axis=1)
+        counts = counts * window
+        gacc = counts.sum(axis=1) / self.ntot
+        gq = self.smooth_quantiles(counts, rt)
+        if not self.include_ss:
+            return hs([1 - gacc, hs(gq)])
+        sacc = 1 - perr_ssd / nss_per
+        eq = self.smooth_quantiles(ecounts, rt)
+        return hs([hs([i[ii] for i in [gacc, sacc, gq, eq]]) for ii in range(nl)])
+
+    def soft_crossing(self, DV, bound, upper=True, shift=.5):
+        """ soft first crossing of traces DV (..., ntimepoints) over bound: a trace
+        that has not crossed yet crosses at each timepoint w/ probability
+        sigmoid((DV - bound - shift*dx)/(dx/4)) (upper) or
+        sigmoid((bound - DV - shift*dx)/(dx/4)) (lower)
+        ::Arguments::
+            shift (float <.5>):
+                distance (in units of dx) past the bound at which the crossing
+                probability is 1/2. Offsets the extra crossings of traces that
+                approach the bound w/o reaching it (.5 for bounds off the lattice of
+                the traces, 0 for bounds on it)
+        ::Returns::
+            surv (ndarray):
+                probability of no crossing up to (and at) each timepoint
+            fpt (ndarray):
+                probability of the first crossing at each timepoint
+        """
+        z = (DV - bound) / (.25 * self.dx)
+        if not upper:
+            z = -z
+        z = z - 4 * shift
+        # log(1 - sigmoid(z)) = -log(1 + exp(z))
+        surv = np.exp(-csum(np.logaddexp(0, z), axis=-1))
+        fpt = -np.diff(surv, axis=-1, prepend=1.)
+        return surv, fpt
+
+    def smooth_quantiles(self, counts, values):
+        """ quantiles of (fractional) counts of each (sorted) value, interpolated
+        linearly between the midpoints of the cumulative counts so they change
+        continuously w/ counts (see hist_quantiles() for integer counts)
+        ::Returns::
+            q (ndarray): quantiles of each row (nrows, nquantiles), nan if row is empty (or nan)
+        """
+        q = []
+        for c, v in zip(counts, values):
+            n = c.sum()
+            keep = c > 0
+            if not np.isfinite(n) or n <= 0 or not keep.any():
+                q.append(self.quantiles * np.nan)
+                continue
+            cdf = (csum(c[keep]) - .5 * c[keep]) / n
+            q.append(np.interp(self.quantiles, cdf, v[keep]))
+        return array(q)
+
+    def simulate_lattice(self, p, analyze=True):
+        """ simulate the go process exactly by propagating probability over
+        the +/-dx lattice (see go_fpt_lattice()). For reactive models, the stop
+        process is simulated (monte carlo) on stop trials only
+        ::Arguments::
+            p (dict):
+                parameter dictionary. values
+            analyze (bool <True>):
+                if True (default) return rt and accuracy information
+                else, return go first-passage-time distribution
+        ::Returns::
+            yhat of cost vector (ndarray)
+            or go first-passage-time distribution (nlevels, ntimepoints)
+        """
+        p = self.vectorize_params(p)
+        nl = len(p['a'])
+        out = self.__update_trace_params__(p)
+        gfpt = self.go_fpt_lattice(out[0], p)
+        if not analyze:
+            return gfpt
+        gacc, gq = self.analyze_fpt(gfpt, p)
+        if not self.include_ss:
+            return hs([1 - gacc, hs(gq)])
+        sacc, eq = self.simulate_stop_trials(p, *out, gfpt=gfpt)
+        return hs([hs([i[ii] for i in [gacc, sacc, gq, eq]]) for ii in range(nl)])
+
+    def go_fpt_lattice(self, Pg, p):
+        """ exact first-passage-time distribution of the go process. DVg only
+        takes values xtb*k*dx (k = -ntime...ntime) so the probability of each lattice
+        state is pushed forward one timestep at a time. The dynamic bias is folded
+        into a time-varying boundary (xtb*k*dx >= a <--> k >= a/(xtb*dx))
+        ::Arguments::
+            Pg (array):
+                probability of DVg +dx for each level
+            p (dict):
+                vectorized parameter dictionary
+        ::Returns::
+            fpt (ndarray):
+                probability of first crossing at each timepoint (nlevels, ntimepoints)
+        """
+        nl, ntime = len(Pg), self.ntime
+        # rvector < Pg is always True (False) for Pg > 1 (< 0)
+        pg = np.clip(Pg, 0, 1)[:, na]
+        kbound = np.ceil(p['a'][:, na] / (self.xtb * self.dx))
+        # lattice state k is stored in column k + ntime
+        k = np.arange(-ntime, ntime + 1)
+        pk = np.zeros((nl, k.size))
+        pk[:, ntime] = 1.
+        fpt = np.zeros((nl, ntime))
+        for t in range(ntime):
+            step = np.zeros_like(pk)
+            step[:, 1:] = pg * pk[:, :-1]
+            step[:, :-1] += (1 - pg) * pk[:, 1:]
+            crossed = k >= kbound[:, t][:, na]
+            fpt[:, t] = np.sum(step * crossed, axis=1)
+            step[crossed] = 0.
+            pk = step
+        return fpt
+
+    def analyze_fpt(self, fpt, p):
+        """ get go accuracy and rt quantiles from a first-passage-time distribution
+        (see go_fpt_lattice()). Quantiles are the rt at which the cumulative
+        probability of responding before tb first exceeds each quantile
+        """
+        rt = p['tr'][:, na] + np.arange(self.ntime) * self.dt
+        # argmax convention: crossing at t=0 is treated as no response
+        presp = np.where(rt < self.tb, fpt, 0)
+        presp[:, 0] = 0
+        gacc = presp.sum(axis=1)
+        cdf = csum(presp, axis=1) / np.where(gacc > 0, gacc, np.nan)[:, na]
+        qix = [np.searchsorted(cdf[i], self.quantiles, side='right') for i in range(len(fpt))]
+        gq = [rt[i][np.minimum(qix[i], self.ntime - 1)] if gacc[i] > 0 else self.quantiles * np.nan for i in range(len(fpt))]
+        return gacc, gq
+
+    def simulate_stop_trials(self, p, Pg, Ps, ss_on, gfpt=None):
+        """ simulate go and stop traces for stop trials only and
+        return stop accuracy and error rt quantiles (see analyze_stop())
+        """
+        nss = self.ssd_info[2]
+        gdec, sdec = self.simulate_decisions(p, Pg, Ps, ss_on, ntrials=nss)
+        return self.analyze_stop(gdec, sdec, p, gfpt=gfpt)
 
     def simulate_rldpm(self, p, analyze=True):
         """ Simulate the dependent process model (DPM)
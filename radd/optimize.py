@@ -8,7 +8,12 @@ from numpy import array
 from radd import theta
 from radd.models import Simulator
 from lmfit import minimize, fit_report
+from lmfit.minimizer import MinimizerResult
 from scipy.optimize import basinhopping
+from scipy.optimize import minimize as scipy_minimize
+from scipy.stats import norm
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, Matern, WhiteKernel
 from numpy.random import uniform
 from radd.tools import utils
 
@@ -37,9 +42,11 @@ class HopStep(object):
     Arguments:
         keys (list): list of parameter names
         stepsize (list): initial stepsize
+        scale (array): dx/du of each parameter if steps are taken in the
+            unconstrained space of a theta.BoundsTransform
     """
-    def __init__(self, keys, nlevels=1, stepsize=0.05):
-        self.stepsize_scalars = theta.get_stepsize_scalars(keys, nlevels)
+    def __init__(self, keys, nlevels=1, stepsize=0.05, scale=1.):
+        self.stepsize_scalars = theta.get_stepsize_scalars(keys, nlevels) / scale
         self.stepsize = stepsize
         self.np = self.stepsize_scalars.size
 
@@ -75,6 +82,12 @@ class Optimizer(object):
         self.constants = deepcopy(['a', 'tr', 'v', 'xb'])
         self.callback = None
         self.progress = False
+        # radd.checkpoint.Checkpoint for saving finished basinhopping runs
+        self.checkpoint = None
+        # crossover probability of differential evolution (see run_evolution)
+        self.recombination = .7
+        # if set, only these params vary in flat fits (see fit_level())
+        self.free_keys = None
 
     def update(self, get_simulator=False, **kwargs):
         kw_keys = list(kwargs)
@@ -93,64 +106,178 @@ class Optimizer(object):
         if get_simulator:
             return self.simulator
 
-    def hop_around(self, inits, pbars=None):
+    def hop_around(self, inits, pbars=None, pool=None):
         """ initialize model with niter randomly generated parameter sets
         and perform global minimization using basinhopping algorithm
         ::Arguments::
             p (dict):
                 parameter dictionary
+            pool (SimulatorPool):
+                if provided, inits are run in parallel by the pool's
+                workers (see radd.parallel)
         ::Returns::
             parameter set with the best fit
         """
         xpopt, xfmin = [], []
-        for i, p in enumerate(inits):
+        schedule = self.get_ntrials_schedule()
+        ix = self.fitparams['ix']
+        hops = {}
+        if self.checkpoint is not None:
+            # basinhopping runs finished before fit was interrupted
+            hops = self.checkpoint.get(('hops', ix), {})
+        if self.basinparams['method']=='DE':
+            # single population search seeded with all inits
+            popt, fmin = self.run_evolution(inits, pool=pool, key=('evolution', ix))
+            xpopt, xfmin = [popt], [fmin]
+        elif self.basinparams['race_niter'] is not None:
+            xpopt, xfmin = self.race_inits(inits, pool=pool)
+        elif pool is not None:
+            callback = None
             if self.progress:
-                self.ibar.update(value=i, status=i)
-                self.callback = self.gbar.reset(get_call=True)
-                if i>0:
-                    self.gbar.reset(bar=True)
-            popt, fmin = self.run_basinhopping(p=p)
-            xpopt.append(popt)
-            xfmin.append(fmin)
+                callback = lambda n: self.ibar.update(value=n, status=n+1)
+            save = None
+            if self.checkpoint is not None:
+                save = lambda i, popt, fmin: self.save_hop(hops, i, popt, fmin)
+            xpopt, xfmin = pool.hop(inits, self.simulator.y, self.simulator.wts, self.basinparams, callback=callback, done=hops, save=save)
+        else:
+            for i, p in enumerate(inits):
+                if i in hops:
+                    xpopt.append(hops[i][0])
+                    xfmin.append(hops[i][1])
+                    continue
+                if self.progress:
+                    self.ibar.update(value=i, status=i)
+                    self.callback = self.gbar.reset(get_call=True)
+                    if i>0:
+                        self.gbar.reset(bar=True)
+                popt, fmin = self.run_basinhopping(p=p)
+                xpopt.append(popt)
+                xfmin.append(fmin)
+                if self.checkpoint is not None:
+                    self.save_hop(hops, i, popt, fmin)
         if self.progress:
             self.ibar.clear()
             self.gbar.clear()
+        for ntrials in schedule[1:]:
+            # promote best half of basinhopping minima to next fidelity
+            nkeep = int(np.ceil(len(xpopt) / 2.))
+            keep = np.argsort(xfmin)[:nkeep]
+            self.simulator.set_ntrials(ntrials)
+            xpopt = [xpopt[i] for i in keep]
+            xfmin = [self.simulator.cost_fx(p, sse=True) for p in xpopt]
         # return parameters at the global basin
-        return xpopt[np.argmin(xfmin)]
+        return xpopt[np.nanargmin(xfmin)]
+
+    def save_hop(self, hops, i, popt, fmin):
+        """ add the finished basinhopping run from init i to hops
+        ({i: (popt, fmin)}) and store them in the checkpoint
+        """
+        hops[i] = (popt, fmin)
+        self.checkpoint.put(('hops', self.fitparams['ix']), hops)
+
+    def race_inits(self, inits, pool=None):
+        """ successive halving of basinhopping runs: each init hops for
+        basinparams['race_niter'] iterations, the best 1/race_eta of the inits
+        continue from their minima w/ race_eta times more iterations (up to niter),
+        until a single init remains
+        ::Arguments::
+            inits (list):
+                list of parameter dictionaries
+            pool (SimulatorPool):
+                if provided, each round of runs is split across the pool's workers
+        ::Returns::
+            xpopt, xfmin (lists) for the remaining init
+        """
+        bp = self.basinparams
+        eta = bp['race_eta']
+        niter = bp['race_niter']
+        xpopt, xfmin = list(inits), None
+        key = ('race', self.fitparams['ix'])
+        if self.checkpoint is not None and self.checkpoint.get(key) is not None:
+            # continue after the last round finished before fit was interrupted
+            niter, xpopt, xfmin = self.checkpoint.get(key)
+        while True:
+            if xfmin is None:
+                round_bp = dict(bp)
+                round_bp['niter'] = int(min(niter, bp['niter']))
+                round_bp['nsuccess'] = int(min(bp['nsuccess'], round_bp['niter']))
+                if pool is not None:
+                    xpopt, xfmin = pool.hop(xpopt, self.simulator.y, self.simulator.wts, round_bp)
+                else:
+                    hops = [self.run_basinhopping(p, niter=round_bp['niter'], nsuccess=round_bp['nsuccess']) for p in xpopt]
+                    xpopt, xfmin = [hop[0] for hop in hops], [hop[1] for hop in hops]
+                if self.checkpoint is not None:
+                    self.checkpoint.put(key, (niter, xpopt, xfmin))
+            if len(xpopt)==1:
+                return xpopt, xfmin
+            # drop all but the best 1/eta inits
+            keep = np.argsort(xfmin)[:max(1, int(len(xpopt) // eta))]
+            xpopt = [xpopt[i] for i in keep]
+            niter, xfmin = niter * eta, None
+
+    def get_ntrials_schedule(self):
+        """ ntrials simulated at each stage of the global optimization
+        (basinparams['ntrials_schedule']), only the first stage is explored with
+        basinhopping (see hop_around). Full fidelity (fitparams['ntrials']) is
+        always used by gradient_descent()
+        """
+        ntrials = self.fitparams['ntrials']
+        schedule = self.basinparams['ntrials_schedule']
+        if schedule is None:
+            return [ntrials]
+        return list(np.minimum(np.sort(schedule), ntrials).astype(int))
 
-    def run_basinhopping(self, p):
+    def run_basinhopping(self, p, niter=None, nsuccess=None):
         """ uses fmin_tnc in combination with basinhopping to perform bounded global
          minimization of multivariate model
         ::Arguments::
             p (dict):
                 parameter dictionary
-            callback (function):
-                callable function for displaying optimization progress
+            niter, nsuccess (int):
+                override basinparams['niter'] and basinparams['nsuccess']
         """
         bp = self.basinparams
         nl = self.fitparams['nlevels']
-        nsuccess = bp['nsuccess']
-        if nl==1:
-            basin_keys = np.sort(list(p))
-            basin_params = theta.scalarize_params(deepcopy(p), is_flat=True)
-        else:
-            basin_keys = np.sort(list(self.pc_map))
-            basin_params = deepcopy(p)
+        if bp['method']=='DE':
+            # population search seeded with p (see run_evolution)
+            return self.run_evolution([p])
+        if niter is None:
+            niter = bp['niter']
+        if nsuccess is None:
+            nsuccess = bp['nsuccess']
+        basin_keys, basin_params = self.get_basin_params(p)
         self.simulator.__prep_global__(basin_params=basin_params, basin_keys=basin_keys)
+        # explore at the lowest fidelity of the ntrials schedule
+        self.simulator.set_ntrials(self.get_ntrials_schedule()[0])
         # make list of init values for all pkeys included in fit
         x0 = np.hstack(np.hstack([basin_params[pk]*np.ones(nl) for pk in basin_keys]))
         # define parameter boundaries for all params in pc_map.keys()
         # to be used by basinhopping minimizer & tnc local optimizer
         xmin, xmax = theta.format_basinhopping_bounds(basin_keys, nlevels=nl, kind=self.kind)
-        tncbounds = theta.format_local_bounds(xmin, xmax)
         tncopt = {'xtol': bp['tol'], 'ftol': bp['tol']}
-        mkwargs = {"method": bp['method'], 'bounds': tncbounds, 'tol': bp['tol'], 'options': tncopt}
-        # define custom take_step and accept_test functions
-        accept_step = BasinBounds(xmin, xmax)
-        custom_step = HopStep(basin_keys, nlevels=nl, stepsize=bp['stepsize'])
+        mkwargs = {"method": bp['method'], 'tol': bp['tol'], 'options': tncopt}
+        if bp['transform']:
+            # search the unconstrained space of theta.BoundsTransform,
+            # every step and local minimum maps back within bounds
+            transform = theta.get_transform(basin_keys, nlevels=nl, kind=self.kind)
+            cost_fx = lambda u: self.simulator.global_cost_fx(transform.inverse(u))
+            x0 = transform.forward(x0)
+            accept_step = None
+            custom_step = HopStep(basin_keys, nlevels=nl, stepsize=bp['stepsize'], scale=transform.scale)
+            callback = self.callback
+            if callback is not None:
+                callback = lambda u, f, accept: self.callback(transform.inverse(u), f, accept)
+        else:
+            cost_fx, callback = self.simulator.global_cost_fx, self.callback
+            mkwargs['bounds'] = theta.format_local_bounds(xmin, xmax)
+            # define custom take_step and accept_test functions
+            accept_step = BasinBounds(xmin, xmax)
+            custom_step = HopStep(basin_keys, nlevels=nl, stepsize=bp['stepsize'])
         # run basinhopping on simulator.basinhopping_minimizer func
-        out = basinhopping(self.simulator.global_cost_fx, x0=x0, minimizer_kwargs=mkwargs, take_step=custom_step, accept_test=accept_step, T=bp['T'], stepsize=bp['stepsize'], niter_success=bp['nsuccess'], niter=bp['niter'], interval=bp['interval'], callback=self.callback)
+        out = basinhopping(cost_fx, x0=x0, minimizer_kwargs=mkwargs, take_step=custom_step, accept_test=accept_step, T=bp['T'], stepsize=bp['stepsize'], niter_success=nsuccess, niter=niter, interval=bp['interval'], callback=callback)
         xopt = out.x
+        if bp['transform']:
+            xopt = transform.inverse(xopt)
         funcmin = out.fun
         if nl > 1:
             xopt = [array([xopt]).reshape(len(basin_keys), nl).squeeze()]
@@ -158,6 +285,109 @@ class Optimizer(object):
             p[k] = xopt[i]
         return p, funcmin
 
+    def get_basin_params(self, p):
+        """ names of the parameters optimized by the global optimizer (all
+        parameters if nlevels=1, else conditional parameters in pc_map)
+        and parameter dict holding the constants
+        """
+        if self.free_keys is not None:
+            basin_keys = np.sort(self.free_keys)
+            basin_params = theta.scalarize_params(deepcopy(p), is_flat=True)
+        elif self.fitparams['nlevels']==1:
+            basin_keys = np.sort(list(p))
+            basin_params = theta.scalarize_params(deepcopy(p), is_flat=True)
+        else:
+            basin_keys = np.sort(list(self.pc_map))
+            basin_params = deepcopy(p)
+        return basin_keys, basin_params
+
+    def run_evolution(self, inits, pool=None, key=None):
+        """ differential evolution (DE/rand/1/bin, F dithered in [.5, 1]) within
+        theta.get_bounds(). The population (popsize * nparams, at least ninits) is
+        seeded with inits and filled w/ uniform samples. Each generation of trial
+        parameter sets is scored as one batch (Simulator.batch_cost_fx, or the
+        workers of pool). Stops after niter generations, nsuccess generations
+        w/o a new global minimum, or when std(fmin) <= tol * |mean(fmin)|. With
+        basinparams['seed'], the search draws from its own RandomState (seed + ix)
+        ::Arguments::
+            inits (list):
+                list of parameter dictionaries
+            pool (SimulatorPool):
+                if provided, generations are scored in parallel (see radd.parallel)
+            key (tuple):
+                if provided (& a checkpoint is set), the population is stored in
+                the checkpoint under key after each generation and the search
+                continues from the stored generation
+        ::Returns::
+            popt (dict), fmin (float) of the best parameter set
+        """
+        bp = self.basinparams
+        nl = self.fitparams['nlevels']
+        rng = np.random
+        if bp['seed'] is not None:
+            # same population & generations for a given seed & subject
+            rng = np.random.RandomState(bp['seed'] + self.fitparams.get('ix', 0))
+        basin_keys, basin_params = self.get_basin_params(inits[0])
+        self.simulator.set_ntrials(self.get_ntrials_schedule()[0])
+        xmin, xmax = [array(lim) for lim in theta.format_basinhopping_bounds(basin_keys, nlevels=nl, kind=self.kind)]
+        ndim = xmin.size
+        npop = max(bp['popsize'] * ndim, len(inits), 4)
+        pop = xmin + rng.random_sample((npop, ndim)) * (xmax - xmin)
+        for i, p in enumerate(inits):
+            _, init_params = self.get_basin_params(p)
+            pop[i] = np.hstack([init_params[pk] * np.ones(nl) for pk in basin_keys])
+        pop = np.clip(pop, xmin, xmax)
+        checkpoint = self.checkpoint if key is not None else None
+        if checkpoint is not None and checkpoint.get(key) is not None:
+            # generations finished before fit was interrupted
+            start, pop, fpop, fbest, nstall, state = checkpoint.get(key)
+            rng.set_state(state)
+            if nstall >= bp['nsuccess'] or np.std(fpop) <= bp['tol'] * np.abs(np.mean(fpop)):
+                # search had already stopped
+                start = bp['niter']
+        else:
+            fpop = self.population_cost(pop, basin_keys, basin_params, pool=pool)
+            start, fbest, nstall = 0, fpop.min(), 0
+        for gen in range(start, bp['niter']):
+            # three distinct members (other than i) for each mutant
+            others = np.array([rng.choice(np.delete(np.arange(npop), i), 3, replace=False) for i in range(npop)])
+            F = rng.uniform(.5, 1.)
+            mutant = pop[others[:, 0]] + F * (pop[others[:, 1]] - pop[others[:, 2]])
+            cross = rng.random_sample((npop, ndim)) < self.recombination
+            cross[np.arange(npop), rng.randint(ndim, size=npop)] = True
+            trial = np.clip(np.where(cross, mutant, pop), xmin, xmax)
+            ftrial = self.population_cost(trial, basin_keys, basin_params, pool=pool)
+            better = ftrial <= fpop
+            pop[better], fpop[better] = trial[better], ftrial[better]
+            nstall += 1
+            if fpop.min() < fbest:
+                fbest, nstall = fpop.min(), 0
+            if checkpoint is not None:
+                checkpoint.put(key, (gen + 1, pop.copy(), fpop.copy(), fbest, nstall, rng.get_state()))
+            if self.callback is not None and self.callback(pop[np.nanargmin(fpop)], fbest, True):
+                break
+            if nstall >= bp['nsuccess'] or np.std(fpop) <= bp['tol'] * np.abs(np.mean(fpop)):
+                break
+        xopt = pop[np.nanargmin(fpop)].reshape(len(basin_keys), nl)
+        p = deepcopy(inits[0])
+        for i, pk in enumerate(basin_keys):
+            p[pk] = xopt[i][0] if nl==1 else xopt[i]
+        return p, fbest
+
+    def population_cost(self, pop, basin_keys, basin_params, pool=None):
+        """ cost of each member (row) of a DE population (see run_evolution)
+        """
+        nl = self.fitparams['nlevels']
+        p_sets = []
+        for x in pop:
+            p = dict(basin_params)
+            for pk, xk in zip(basin_keys, x.reshape(len(basin_keys), nl)):
+                p[pk] = xk if nl>1 else xk[0]
+            p_sets.append(p)
+        if pool is not None:
+            return array(pool.cost(p_sets, self.simulator.y, self.simulator.wts))
+        return self.simulator.batch_cost_fx(p_sets)
+
     def gradient_descent(self, p, flat=True):
         """ Optimizes parameters following specified parameter
         dependencies on task conditions (i.e. depends_on={param: cond})
@@ -176,15 +406,208 @@ class Optimizer(object):
                 optimized parameters dictionary
         """
         fp = self.fitparams
-        optkws = {'xtol': fp['tol'], 'ftol': fp['tol'], 'maxfev': fp['maxfev']}
         # make lmfit Parameters object to keep track of
         # parameter names and dependencies during fir
         lmParams = theta.loadParameters(inits=p, pc_map=self.pc_map, is_flat=flat, kind=self.kind)
-        self.lmMin = minimize(self.simulator.cost_fx, lmParams, method=fp['method'], options=optkws)
+        if self.free_keys is not None:
+            for name in lmParams:
+                lmParams[name].vary = name in self.free_keys
+        self.simulator.set_ntrials(fp['ntrials'])
+        tol = fp['tol']
+        optkws = {'xtol': tol, 'ftol': tol, 'maxfev': fp['maxfev']}
+        if isinstance(tol, str) and tol=='noise':
+            # stop once the simplex is within the monte carlo noise of the cost
+            # (fatol, cost units) & spans < .1% of each param's range (xatol, in
+            # lmfit's internal arcsin coords, where every bounded param spans pi)
+            self.noise = self.simulator.noise_floor(p)
+            # ftol of L-BFGS-B & TNC (& batch_lbfgsb) is relative to max(|cost|, 1),
+            # so the cost sd is scaled to stop at the same absolute change
+            tol = self.noise['cost_sd'] / max(self.noise['cost'], 1.)
+            optkws = {'ftol': tol, 'maxfev': fp['maxfev']}
+            if fp['method'] in ['nelder', 'Nelder-Mead']:
+                optkws = {'xatol': 2e-3, 'fatol': self.noise['cost_sd'], 'maxfev': fp['maxfev']}
+        if fp['method']=='surrogate':
+            self.lmMin = self.run_surrogate(lmParams)
+        elif fp['method']=='batch_lbfgsb':
+            self.lmMin = self.run_batch_lbfgsb(lmParams, tol=tol)
+        else:
+            self.lmMin = minimize(self.simulator.cost_fx, lmParams, method=fp['method'], options=optkws)
         #self.lmMinimizer = deepcopy(lmMinimizer)
         self.param_report = fit_report(self.lmMin.params)
         return self.assess_fit(flat=flat)
 
+    def levels_separable(self):
+        """ True if the conditional fit splits into one flat fit per level: every
+        parameter optimized across levels is conditional (one value per level) and
+        the rest are fixed, so each level's params only change its slice of yhat
+        """
+        nl = self.fitparams['nlevels']
+        return nl > 1 and len(self.pc_map) > 0 and all([len(pkc)==nl for pkc in self.pc_map.values()])
+
+    def fit_levels(self, p, nworkers=1):
+        """ conditional fit (as run_basinhopping + gradient_descent(flat=False))
+        solved as nlevels independent flat fits of the conditional params, one per
+        level w/ its own Simulator (see Simulator.level_fitparams and parallel.fit_level),
+        run on nworkers processes. popt & yhat are assembled from the level fits and
+        re-simulated on the conditional Simulator
+        ::Arguments::
+            p (dict):
+                parameter dictionary (flat popt w/ conditional inits)
+            nworkers (int):
+                n processes (1 --> fit levels one after the other)
+        ::Returns::
+            finfo, popt, yhat (see gradient_descent())
+        """
+        from radd import parallel
+        bp = dict(self.basinparams)
+        bp['progress'], bp['nworkers'] = False, 1
+        nl, free = self.fitparams['nlevels'], np.sort(list(self.pc_map))
+        tasks = []
+        for level in range(nl):
+            # level's value of conditional params, flat value of the rest
+            p_level = {pk: np.mean(val) for pk, val in p.items()}
+            for pk in free:
+                p_level[pk] = np.atleast_1d(p[pk])[min(level, np.size(p[pk]) - 1)]
+            tasks.append((level, self.simulator.level_fitparams(level), bp, self.kind, p_level, free, None))
+        if nworkers > 1:
+            fits = parallel.fit_levels(tasks, nworkers=nworkers)
+        else:
+            fits = [parallel.fit_level(task) for task in tasks]
+        for pk in free:
+            p[pk] = array([popt[pk] for popt, nfev, success in fits])
+        lmParams = theta.loadParameters(inits=p, pc_map=self.pc_map, is_flat=False, kind=self.kind)
+        self.simulator.set_ntrials(self.fitparams['ntrials'])
+        residual = self.simulator.cost_fx(lmParams)
+        names = [name for name in lmParams if lmParams[name].vary]
+        nfev = sum([nfev for popt, nfev, success in fits])
+        success = all([success for popt, nfev, success in fits])
+        self.lmMin = MinimizerResult(params=deepcopy(lmParams), residual=residual, nfev=nfev + 1, success=success, var_names=names, method='levels')
+        self.param_report = fit_report(self.lmMin.params)
+        return self.assess_fit(flat=False)
+
+    def run_surrogate(self, lmParams, ncandidates=2000, refit_every=10):
+        """ Bayesian optimization of cost_fx over the varying parameters in
+        lmParams (within their theta.get_bounds() limits), spending at most
+        basinparams['surrogate_evals'] simulations (default 150). A gaussian process
+        (Matern + white noise kernel, so monte carlo jitter is modeled as noise) is
+        fit to log(sse) of all simulated sets, and the next set is the candidate with
+        the highest expected improvement over the best predicted (not simulated) cost
+        ::Arguments::
+            lmParams (Parameters):
+                lmfit Parameters (inits, bounds) built in gradient_descent()
+            ncandidates (int):
+                n random candidates (+ n near the incumbent) scored by the acquisition
+            refit_every (int):
+                kernel hyperparameters are re-optimized every refit_every simulations
+                (and held fixed in between, so each GP fit is a single cholesky)
+        ::Returns::
+            MinimizerResult w/ params, residual, nfev (see assess_fit())
+        """
+        bp = self.basinparams or {}
+        nevals = bp.get('surrogate_evals', 150)
+        names = [name for name in lmParams if lmParams[name].vary]
+        lo = array([lmParams[name].min for name in names])
+        hi = array([lmParams[name].max for name in names])
+        ndim = len(names)
+        def set_values(u):
+            for name, val in zip(names, lo + u * (hi - lo)):
+                lmParams[name].value = val
+            return lmParams
+        def cost(u):
+            return float(self.simulator.cost_fx(set_values(u), sse=True))
+        # design: inits + uniform samples in unit cube
+        ninit = min(max(2 * ndim + 1, 10), nevals)
+        x0 = array([lmParams[name].value for name in names])
+        U = np.vstack([np.clip((x0 - lo) / (hi - lo), 0, 1), np.random.random_sample((ninit - 1, ndim))])
+        Y = [cost(u) for u in U]
+        kernel = ConstantKernel() * Matern(length_scale=.3 * np.ones(ndim), length_scale_bounds=(1e-2, 1e1), nu=2.5) + WhiteKernel(1e-2, (1e-8, 1e1))
+        gp = GaussianProcessRegressor(kernel=kernel, normalize_y=True, n_restarts_optimizer=1)
+        while True:
+            yobs = array(Y)
+            # hyperparameter search (L-BFGS-B on the marginal likelihood) is the
+            # expensive part of each fit, so only run it every refit_every sets
+            gp.optimizer = 'fmin_l_bfgs_b' if (len(Y) - ninit) % refit_every == 0 else None
+            gp.fit(U, np.log(yobs + 1e-12))
+            # incumbent is the simulated set w/ lowest predicted cost
+            mu_obs = gp.predict(U)
+            ubest, zbest = U[np.argmin(mu_obs)], mu_obs.min()
+            if len(Y) >= nevals:
+                break
+            local = np.clip(ubest + np.random.normal(0, .05, (ncandidates, ndim)), 0, 1)
+            candidates = np.vstack([np.random.random_sample((ncandidates, ndim)), local])
+            mu, sd = gp.predict(candidates, return_std=True)
+            sd = np.maximum(sd, 1e-12)
+            zimp = (zbest - mu) / sd
+            ei = (zbest - mu) * norm.cdf(zimp) + sd * norm.pdf(zimp)
+            unext = candidates[np.argmax(ei)]
+            U = np.vstack([U, unext])
+            Y.append(cost(unext))
+            # warm start next fit from the fitted kernel
+            gp.kernel = gp.kernel_
+        set_values(ubest)
+        residual = self.simulator.cost_fx(lmParams)
+        return MinimizerResult(params=deepcopy(lmParams), residual=residual, nfev=len(Y) + 1, success=True, var_names=names, method='surrogate')
+
+    def run_batch_lbfgsb(self, lmParams, tol=1.e-30, step=None):
+        """ L-BFGS-B minimization of the sse over the varying parameters in lmParams
+        (within their theta.get_bounds() limits) w/ a central finite-difference gradient.
+        The current set and its 2 * nparams perturbations are simulated together in one
+        batch_sim_fx() pass, so all share the same rvector (common random numbers) and
+        each optimizer step is one wide simulation. Stops once fitparams['maxfev']
+        sets have been simulated and returns the best simulated set
+        ::Arguments::
+            lmParams (Parameters):
+                lmfit Parameters (inits, bounds) built in gradient_descent()
+            tol (float):
+                ftol of L-BFGS-B (relative reduction of the cost per iteration)
+            step (float):
+                finite-difference step of each parameter, as a fraction of its bounds
+                (default: .001 for engine='smooth', else .01 so the step spans
+                the jumps of the monte carlo cost)
+        ::Returns::
+            MinimizerResult w/ params, residual, nfev (see assess_fit())
+        """
+        fp = self.fitparams
+        names = [name for name in lmParams if lmParams[name].vary]
+        lo = array([lmParams[name].min for name in names])
+        hi = array([lmParams[name].max for name in names])
+        ndim, nsets = len(names), 2 * len(names) + 1
+        if step is None:
+            step = .001 if self.simulator.engine=='smooth' else .01
+        h = step * (hi - lo)
+        best = {'x': None, 'f': np.inf, 'nfev': 0}
+        def set_values(x):
+            for name, val in zip(names, x):
+                lmParams[name].value = val
+            return lmParams
+        def cost_grad(x):
+            if best['nfev'] + nsets > fp['maxfev']:
+                # out of simulations, a zero gradient ends the search
+                return best['f'], np.zeros(ndim)
+            # x, then x + h_i and x - h_i for each parameter (clipped to bounds)
+            X = np.tile(x, (nsets, 1))
+            X[1:ndim+1] += np.diag(h)
+            X[ndim+1:] -= np.diag(h)
+            X = np.clip(X, lo, hi)
+            p_sets = [deepcopy(set_values(xi).valuesdict()) for xi in X]
+            yhats = self.simulator.batch_sim_fx(p_sets)
+            best['nfev'] += nsets
+            f = np.sum(self.simulator.residuals(yhats)**2, axis=1)
+            f0, fplus, fminus = f[0], f[1:ndim+1], f[ndim+1:]
+            if f0 < best['f']:
+                best['x'], best['f'] = x.copy(), f0
+            # one-sided differences at the bounds
+            dplus, dminus = np.diag(X[1:ndim+1]) - x, x - np.diag(X[ndim+1:])
+            fplus, fminus = np.where(dplus > 0, fplus, f0), np.where(dminus > 0, fminus, f0)
+            span = dplus + dminus
+            grad = (fplus - fminus) / np.where(span > 0, span, 1)
+            return f0, grad
+        x0 = np.clip([lmParams[name].value for name in names], lo, hi)
+        opt = scipy_minimize(cost_grad, x0, jac=True, method='L-BFGS-B', bounds=list(zip(lo, hi)), options={'maxfun': fp['maxfev'], 'ftol': tol})
+        set_values(best['x'] if best['x'] is not None else x0)
+        residual = self.simulator.cost_fx(lmParams)
+        return MinimizerResult(params=deepcopy(lmParams), residual=residual, nfev=best['nfev'] + 1, success=opt.success, var_names=names, method='batch_lbfgsb')
+
     def assess_fit(self, flat=True):
         """ wrapper for analyze.assess_fit calculates and stores
         rchi, AIC, BIC and other fit statistics
@@ -216,6 +639,9 @@ class Optimizer(object):
         finfo['logp'] = finfo.ndata * np.log(finfo.rchi)
         finfo['AIC'] = finfo.logp + 2 * finfo.nvary
         finfo['BIC'] = finfo.logp + np.log(finfo.ndata * finfo.nvary)
+        # SeedSequence of the simulator's random streams (None if not seeded),
+        # pass it as fitparams['seed'] to simulate on the same rvector
+        finfo['seed'] = self.simulator.seed_seq
         return finfo, popt, fp['yhat']
 
     def make_progress_bars(self):
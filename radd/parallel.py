@@ -0,0 +1,262 @@
+#!/usr/local/bin/env python
+from __future__ import division
+from copy import deepcopy
+import multiprocessing as mp
+import numpy as np
+from radd.models import Simulator
+from radd import theta
+
+# Simulator held by each worker process (see init_worker())
+worker_sim = None
+
+def init_worker(fitparams, kind, pc_map, seed):
+    """ build the Simulator used by a worker process. All workers draw
+    the same rvector from seed and simulate the longest possible trials
+    (tr=0) so the cost of a parameter set does not depend on the worker
+    that scores it or on what that worker has simulated before
+    """
+    global worker_sim
+    if seed is not None:
+        np.random.seed(seed)
+    worker_sim = Simulator(fitparams=fitparams, kind=kind, pc_map=pc_map)
+    worker_sim.ntime = int(np.ceil(worker_sim.tb / worker_sim.dt))
+    worker_sim.__update_rand_vectors__()
+
+def score_shard(args):
+    """ cost (sse) of each parameter set in a shard of p_sets
+    ::Arguments::
+        args (tuple):
+            y, wts (observed data & weights of the current fit) and p_sets
+    ::Returns::
+        fmins (list): cost of each parameter set
+    """
+    y, wts, p_sets = args
+    worker_sim.y, worker_sim.wts = y, wts
+    return worker_sim.batch_cost_fx(p_sets).tolist()
+
+def simulate_shard(args):
+    """ simulated yhat of each parameter set in a shard of p_sets
+    (see SimulatorPool.sim)
+    """
+    return worker_sim.batch_sim_fx(args)
+
+def hop_init(args):
+    """ run basinhopping (Optimizer.run_basinhopping) from a single init
+    on the worker's Simulator, seeding the global RNG (used by HopStep and
+    basinhopping) so each init has its own random stream
+    ::Arguments::
+        args (tuple):
+            i (index of init), y, wts, basinparams, p (init params), seed
+    ::Returns::
+        i, popt, fmin
+    """
+    from radd.optimize import Optimizer
+    i, y, wts, basinparams, p, seed = args
+    np.random.seed(seed)
+    worker_sim.y, worker_sim.wts = y, wts
+    optimizer = Optimizer(simulator=worker_sim, basinparams=basinparams)
+    popt, fmin = optimizer.run_basinhopping(p=p)
+    return i, popt, fmin
+
+def spawn_seeds(tasks):
+    """ set the last element (rng seed) of each task to its own spawned
+    SeedSequence. Forked workers inherit the parent's global RNG state, so
+    tasks w/o basinparams['seed'] would otherwise draw the same random numbers
+    """
+    seeds = np.random.SeedSequence().spawn(len(tasks))
+    return [tuple(task[:-1]) + (seed,) for task, seed in zip(tasks, seeds)]
+
+def seed_task(bp, rng_seed):
+    """ reseed the global RNG from a task's spawned SeedSequence (see
+    spawn_seeds) when basinparams['seed'] is None (a seeded task seeds itself)
+    """
+    if bp['seed'] is None and rng_seed is not None:
+        np.random.seed(rng_seed.generate_state(4))
+
+def fit_subject(args):
+    """ fit the flat (unless flat_popt is given) and conditional (if cond_fp
+    is given) models of one subject with its own Simulator & Optimizer,
+    following Model.optimize_flat() and Model.optimize_conditional(). Global RNG
+    draws follow the serial loop, so fits match serial fits if rvector is seeded
+    (fitparams['seed']) and inits are seeded (basinparams['seed'], no sim_bank).
+    Unseeded subjects draw from their own stream (rng_seed, see spawn_seeds)
+    ::Arguments::
+        args (tuple):
+            ix, flat_fp, cond_fp, basinparams, kind, pc_map,
+            depends_on, inits, flat_popt, bank (p_sets & yhats
+            of a simulation bank, see RADDCore.get_sim_bank, or None),
+            rng_seed (SeedSequence or None)
+    ::Returns::
+        fits (dict):
+            {'ix': ix, 'flat': (finfo, popt, yhat, param_report), 'cond': (...)}
+    """
+    from radd.optimize import Optimizer
+    ix, flat_fp, cond_fp, bp, kind, pc_map, depends_on, inits, flat_popt, bank, rng_seed = args
+    seed_task(bp, rng_seed)
+    fits = {'ix': ix}
+    if flat_popt is None:
+        # same order of global RNG draws as the serial loop: rvector (set_fitparams),
+        # then seed & inits (RADDCore.sample_param_sets), then basinhopping
+        optimizer = Optimizer(simulator=Simulator(fitparams=flat_fp, kind=kind, pc_map=pc_map), basinparams=bp)
+        if bank is None:
+            if bp['seed'] is not None:
+                np.random.seed(bp['seed'] + ix)
+            pkeys = np.sort(list(inits))
+            p_sets = theta.random_inits(pkeys, ninits=bp['nsamples'], kind=kind, as_list=True)
+            if optimizer.simulator.emulates(p_sets[0]):
+                p_fmins = optimizer.simulator.batch_cost_fx(p_sets)
+            else:
+                p_fmins = [optimizer.simulator.cost_fx(p, sse=1) for p in p_sets]
+        else:
+            p_sets, yhats = bank
+            p_fmins = np.sum(optimizer.simulator.residuals(yhats)**2, axis=1)
+        param_sets, gmin = theta.filter_params(p_sets, p_fmins, nkeep=bp['ninits'], method=bp['init_sample_method'])
+        param_sets = deepcopy(param_sets)
+        p = optimizer.hop_around(inits=param_sets)
+        finfo, popt, yhat = optimizer.gradient_descent(p=p)
+        fits['flat'] = (finfo, popt, yhat, optimizer.param_report)
+        flat_popt = popt
+    if cond_fp is not None:
+        if 'flat' in fits:
+            # as set_fitparams(nlevels=nlevels) after the flat fit in the serial loop
+            optimizer.update(fitparams=cond_fp)
+        else:
+            optimizer = Optimizer(simulator=Simulator(fitparams=cond_fp, kind=kind, pc_map=pc_map), basinparams=bp)
+        p = theta.check_inits(inits=dict(deepcopy(flat_popt)), depends_on=depends_on, kind=kind)
+        if bp['split_levels'] and optimizer.levels_separable():
+            # levels are fit one after the other (already in a worker process)
+            finfo, popt, yhat = optimizer.fit_levels(p)
+        else:
+            p, fmin = optimizer.run_basinhopping(p)
+            finfo, popt, yhat = optimizer.gradient_descent(p=p, flat=False)
+        fits['cond'] = (finfo, popt, yhat, optimizer.param_report)
+    return fits
+
+def fit_level(args):
+    """ fit the conditional params (free) of one level w/ its own flat Simulator
+    & Optimizer, the other params held at their values in p (see Optimizer.fit_levels)
+    ::Arguments::
+        args (tuple):
+            level, fitparams (see Simulator.level_fitparams), basinparams, kind, p, free,
+            rng_seed (SeedSequence or None, see spawn_seeds)
+    ::Returns::
+        popt, nfev, success
+    """
+    from radd.optimize import Optimizer
+    level, fp, bp, kind, p, free, rng_seed = args
+    if bp['seed'] is not None:
+        np.random.seed(bp['seed'] + level)
+    seed_task(bp, rng_seed)
+    optimizer = Optimizer(simulator=Simulator(fitparams=fp, kind=kind, pc_map={}), basinparams=bp)
+    optimizer.free_keys = list(free)
+    p, fmin = optimizer.run_basinhopping(p)
+    finfo, popt, yhat = optimizer.gradient_descent(p=p)
+    return popt, finfo['nfev'], finfo['cnvrg']
+
+def fit_levels(tasks, nworkers=2):
+    """ run fit_level() for each task (one per level) on a pool
+    of nworkers processes, returns fits in tasks order
+    """
+    pool = mp.Pool(processes=min(nworkers, len(tasks)))
+    try:
+        return pool.map(fit_level, spawn_seeds(tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+def fit_subjects(tasks, nworkers=2):
+    """ run fit_subject() for each task (one per subject) on a pool
+    of nworkers processes, yielding fits in tasks order as they finish
+    """
+    pool = mp.Pool(processes=nworkers)
+    try:
+        for fits in pool.imap(fit_subject, spawn_seeds(tasks)):
+            yield fits
+    finally:
+        pool.close()
+        pool.join()
+
+
+class SimulatorPool(object):
+    """ pool of worker processes, each holding a Simulator built
+    from the same fitparams, used to score parameter sets in parallel.
+    Workers are kept alive between calls to cost() (i.e. reused across
+    subjects) and only rebuilt if the structure of the fit changes
+
+    Arguments:
+        fitparams (dict): fitparams used to build each worker's Simulator
+        kind (str): model kind
+        pc_map (dict): parameter --> condition map
+        nworkers (int): number of worker processes
+        seed (int): seed for worker rvectors (None --> random)
+    """
+    def __init__(self, fitparams, kind='xdpm', pc_map={}, nworkers=2, seed=None):
+        self.fitparams = dict(deepcopy(fitparams))
+        self.kind = kind
+        self.pc_map = pc_map
+        self.nworkers = nworkers
+        self.seed = seed
+        if seed is None:
+            seed = np.random.randint(0, 2**30)
+        # seed actually used by workers, hop() streams are offset from it
+        self.rseed = seed
+        initargs = (self.fitparams, kind, pc_map, seed)
+        self.pool = mp.Pool(processes=nworkers, initializer=init_worker, initargs=initargs)
+
+    def matches(self, fitparams, kind, pc_map, nworkers, seed):
+        """ True if worker Simulators can be reused for a fit with fitparams
+        (only y & wts vectors differ, which are sent with each shard)
+        """
+        keys = ['nlevels', 'ntrials', 'tb', 'engine', 'max_bytes', 'compact', 'emulator', 'antithetic', 'stratified', 'control_variate', 'seed', 'smooth_h']
+        same_fp = all([self.fitparams.get(k) == fitparams.get(k) for k in keys])
+        if 'ssd_info' in fitparams.keys():
+            same_fp = same_fp and np.all([np.array_equal(a, b) for a, b in zip(self.fitparams['ssd_info'], fitparams['ssd_info'])])
+        return same_fp and kind==self.kind and pc_map==self.pc_map and nworkers==self.nworkers and seed==self.seed
+
+    def cost(self, p_sets, y, wts):
+        """ score p_sets (list of parameter dicts) against y, splitting
+        them into nworkers contiguous shards, returns fmins in p_sets order
+        """
+        shards = [list(shard) for shard in np.array_split(np.arange(len(p_sets)), self.nworkers)]
+        tasks = [(y.flatten(), wts.flatten(), [p_sets[i] for i in shard]) for shard in shards if len(shard)]
+        return sum(self.pool.map(score_shard, tasks), [])
+
+    def sim(self, p_sets):
+        """ simulate yhat for p_sets (list of parameter dicts), split
+        into nworkers contiguous shards, returns (len(p_sets), len(yhat))
+        """
+        shards = [list(shard) for shard in np.array_split(np.arange(len(p_sets)), self.nworkers)]
+        tasks = [[p_sets[i] for i in shard] for shard in shards if len(shard)]
+        return np.vstack(self.pool.map(simulate_shard, tasks))
+
+    def hop(self, inits, y, wts, basinparams, callback=None, done=None, save=None):
+        """ run basinhopping from each init in inits (list of parameter dicts),
+        one init per task, returns popts & fmins in inits order
+        ::Arguments::
+            callback (function):
+                called in the parent as callback(n) after n inits have finished
+            done (dict):
+                {i: (popt, fmin)} of inits already run (e.g., restored from a
+                checkpoint), these are not run again
+            save (function):
+                called in the parent as save(i, popt, fmin) as each init finishes
+        """
+        bp = dict(basinparams)
+        bp['progress'] = False
+        done = done or {}
+        tasks = [(i, y.flatten(), wts.flatten(), bp, p, self.rseed + i + 1) for i, p in enumerate(inits) if i not in done]
+        xpopt, xfmin = [None] * len(inits), [None] * len(inits)
+        for i in done:
+            xpopt[i], xfmin[i] = done[i]
+        for n, (i, popt, fmin) in enumerate(self.pool.imap_unordered(hop_init, tasks)):
+            xpopt[i], xfmin[i] = popt, fmin
+            if save is not None:
+                save(i, popt, fmin)
+            if callback is not None:
+                callback(n)
+        return xpopt, xfmin
+
+    def close(self):
+        """ shut down worker processes """
+        self.pool.close()
+        self.pool.join()
@@ -413,6 +413,40 @@ def get_stepsize_scalars(keys, nlevels=1):
         stepsize_scalars = stepsize_scalars.squeeze()
     return stepsize_scalars
 
+def get_transform(basin_keys, nlevels=1, kind='dpm'):
+    """ BoundsTransform for the parameters of a global search, laid out
+    as in format_basinhopping_bounds() """
+    xmin, xmax = format_basinhopping_bounds(basin_keys, nlevels=nlevels, kind=kind)
+    return BoundsTransform(xmin, xmax)
+
+class BoundsTransform(object):
+    """ maps parameters within their bounds to an unconstrained space and back,
+    u = logit((x - xmin) / (xmax - xmin)), so optimizers can step anywhere w/o
+    leaving the bounds. ssv is mapped on its kind-specific (negative for dpm,
+    positive for irace) interval from get_bounds(). forward() and inverse() take
+    arrays of any shape w/ parameters on the last axis (e.g. a whole population)
+
+    Arguments:
+        xmin (list): lower boundaries for each parameter
+        xmax (list): upper boundaries for each parameter
+        eps (float): bounds are mapped to logit(eps) and logit(1 - eps)
+    """
+    def __init__(self, xmin, xmax, eps=1e-9):
+        self.xmin = np.array(xmin, dtype=np.float64)
+        self.span = np.array(xmax, dtype=np.float64) - self.xmin
+        self.eps = eps
+        # dx/du at the center of the bounds (scales steps taken in u)
+        self.scale = self.span / 4.
+
+    def forward(self, x):
+        """ unconstrained u of parameters x """
+        q = np.clip((np.asarray(x) - self.xmin) / self.span, self.eps, 1 - self.eps)
+        return np.log(q) - np.log1p(-q)
+
+    def inverse(self, u):
+        """ parameters x (within bounds) of unconstrained u """
+        return self.xmin + self.span * .5 * (1 + np.tanh(.5 * np.asarray(u)))
+
 def get_default_inits(kind='dpm', depends_on={}):
     """ if user does not provide inits dict when initializing Model instance,
     grab default dictionary of init params reasonably suited for Model kind
@@ -11,7 +11,7 @@ setup(
     packages=['radd', 'radd.rl', 'radd.tools', 'radd.examples'],
     package_data=package_data,
     description='RADD (Race Against Drift-Diffusion model) is a python package for fitting & simulating cognitive models of reinforcement learning and decision-making',
-    install_requires=['numpy>=1.8.2', 'scipy>=0.16.1', 'matplotlib>=1.4.3', 'seaborn>=0.5.1', 'pandas>=0.15.1', 'lmfit>=0.9.1', 'scikit-learn>=0.17.1', 'progressbar2>=3.9.3', 'future'],
+    install_requires=['numpy>=1.17', 'scipy>=0.16.1', 'matplotlib>=1.4.3', 'seaborn>=0.5.1', 'pandas>=0.15.1', 'lmfit>=0.9.1', 'scikit-learn>=0.18', 'progressbar2>=3.9.3', 'future'],
     include_dirs = [np.get_include()],
     classifiers=[
                 'Environment :: Console',
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from radd.checkpoint import Checkpoint
+from radd.optimize import Optimizer
+from test_simulator import p, make_simulator
+
+basinparams = {'method': 'DE', 'seed': 7, 'popsize': 3, 'niter': 6, 'nsuccess': 6,
+               'tol': 1e-6, 'ntrials_schedule': None, 'race_niter': None}
+
+def make_optimizer(path=None, resume=False):
+    sim = make_simulator(500, seed=1)
+    sim.y = make_simulator(5000, seed=2).sim_fx(dict(p))
+    optimizer = Optimizer(simulator=sim, basinparams=dict(basinparams))
+    if path is not None:
+        optimizer.checkpoint = Checkpoint(path, interval=0., resume=resume)
+    return optimizer
+
+
+def test_resumed_evolution_reproduces_fmin(tmpdir, monkeypatch):
+    path = str(tmpdir.join('fit.ckpt'))
+    popt, fmin = make_optimizer().run_evolution([dict(p)])
+    # interrupt the search after its 3rd generation
+    population_cost = Optimizer.population_cost
+    ncalls = []
+    def interrupted_cost(self, *args, **kwargs):
+        ncalls.append(1)
+        if len(ncalls) > 4:
+            raise KeyboardInterrupt
+        return population_cost(self, *args, **kwargs)
+    monkeypatch.setattr(Optimizer, 'population_cost', interrupted_cost)
+    with pytest.raises(KeyboardInterrupt):
+        make_optimizer(path).run_evolution([dict(p)], key=('evolution', 0))
+    monkeypatch.setattr(Optimizer, 'population_cost', population_cost)
+    assert Checkpoint(path).get(('evolution', 0))[0] == 3
+    optimizer = make_optimizer(path, resume=True)
+    popt_resumed, fmin_resumed = optimizer.run_evolution([dict(p)], key=('evolution', 0))
+    assert fmin_resumed == fmin
+    assert popt_resumed == popt
+
+
+def test_resumed_hops_are_not_rerun(tmpdir, monkeypatch):
+    path = str(tmpdir.join('fit.ckpt'))
+    optimizer = make_optimizer(path)
+    optimizer.basinparams['method'] = 'TNC'
+    inits = [dict(p), dict(p, v=.9)]
+    saved = {0: (dict(p, a=.41), 1.5), 1: (dict(p, a=.43), .5)}
+    optimizer.checkpoint.put(('hops', 0), saved, force=True)
+    def run_basinhopping(self, *args, **kwargs):
+        raise AssertionError('finished hop was run again')
+    monkeypatch.setattr(Optimizer, 'run_basinhopping', run_basinhopping)
+    resumed = make_optimizer(path, resume=True)
+    resumed.basinparams['method'] = 'TNC'
+    assert resumed.hop_around(inits) == saved[1][0]
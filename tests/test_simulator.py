@@ -0,0 +1,63 @@
+import numpy as np
+from scipy.stats.mstats import mquantiles
+from radd.models import Simulator
+
+p = {'a': .4, 'tr': .25, 'v': 1.1, 'xb': 1.5, 'ssv': -1.}
+
+def make_fitparams(ntrials=1000, **kwargs):
+    """ flat xdpm fitparams w/ 5 ssds (24 yhat values) """
+    ssd = np.array([[.2, .25, .3, .35, .4]])
+    ssd_info = [ssd, 5, ntrials // 2, ntrials // 10, np.arange(5) * np.ones((1, 5)).astype(int)]
+    fp = {'ix': 0, 'ntrials': ntrials, 'tb': .65, 'nlevels': 1, 'clmap': {'flat': ['flat']},
+          'quantiles': np.arange(.1, 1, .1), 'y': np.zeros(24), 'wts': np.ones(24), 'ssd_info': ssd_info}
+    fp.update(kwargs)
+    return fp
+
+def make_simulator(ntrials=1000, **kwargs):
+    return Simulator(fitparams=make_fitparams(ntrials, **kwargs), kind='xdpm', pc_map={})
+
+
+def test_hist_quantiles_matches_mquantiles():
+    sim = make_simulator()
+    rng = np.random.RandomState(0)
+    values = np.sort(rng.uniform(.2, .65, size=(3, 40)), axis=1)
+    counts = rng.poisson(2., size=(3, 40))
+    counts[1, :] = 0
+    counts[2, :] = 0
+    counts[2, 7] = 1
+    q = sim.hist_quantiles(counts, values)
+    for row in range(3):
+        data = np.repeat(values[row], counts[row])
+        if data.size == 0:
+            assert np.all(np.isnan(q[row]))
+        else:
+            expected = mquantiles(data, prob=sim.quantiles, alphap=.4, betap=.4)
+            np.testing.assert_allclose(q[row], expected)
+
+def test_batch_sim_fx_matches_sim_fx():
+    p_sets = [dict(p), dict(p, v=.9, a=.45), dict(p, ssv=-1.3)]
+    for kwargs in [{}, {'seed': 3, 'max_bytes': 2e5}]:
+        sim = make_simulator(**kwargs)
+        yhats = sim.batch_sim_fx(p_sets)
+        for yhat, p_set in zip(yhats, p_sets):
+            np.testing.assert_array_equal(yhat, sim.sim_fx(dict(p_set)))
+
+def test_lattice_matches_monte_carlo():
+    # independent MC stream, quantiles agree within a few dt (.005) steps
+    yhat_mc = make_simulator(10000, seed=2).sim_fx(dict(p))
+    yhat_lattice = make_simulator(10000, seed=1, engine='lattice').sim_fx(dict(p))
+    np.testing.assert_allclose(yhat_lattice, yhat_mc, atol=.02)
+
+def test_compact_matches_full():
+    p_sets = [dict(p), dict(p, v=.9, a=.45)]
+    for kwargs in [{'seed': 3}, {'seed': 3, 'max_bytes': 2e5}]:
+        full = make_simulator(**kwargs).batch_sim_fx(p_sets)
+        compact = make_simulator(compact=True, **kwargs).batch_sim_fx(p_sets)
+        np.testing.assert_array_equal(compact, full)
+
+def test_seeded_yhat_does_not_depend_on_max_bytes():
+    yhat = make_simulator(2000, seed=5).sim_fx(dict(p))
+    # chunks of 12, 120 & 256 trials (smaller & larger than rvector blocks)
+    for max_bytes in [1e5, 1e6, 3e6]:
+        sim = make_simulator(2000, seed=5, max_bytes=max_bytes)
+        np.testing.assert_array_equal(sim.sim_fx(dict(p)), yhat)